@@ -1,6 +1,11 @@
 import numpy as np
 from scipy import optimize
 
+import activations
+import inputs
+import instrumentation
+import parallel
+
 __author__ = 'John Bucknam & Bill Clark'
 
 
@@ -13,63 +18,273 @@ class ForwardNN(object):
     # CONSTANTS
     SUM_OF_SQUARES_TYPE = "Sum of Squares"
     CROSS_ENTROPY_TYPE = "Cross Entropy"
+    NORMAL_INIT = "normal"
+    XAVIER_INIT = "xavier"
+    HE_INIT = "he"
+    # Registry losses computing the cost picked by cost_function_type when no loss is set
+    _LEGACY_LOSSES = {SUM_OF_SQUARES_TYPE: activations.SumOfSquares(), CROSS_ENTROPY_TYPE: activations.CrossEntropy()}
 
     #Variables
     inputLayerSize = None
     outputLayerSize = None
     hiddenLayerSizes = None
+    layerSizes = None
+    dtype = None
+    activation = None
+    loss = None
+    hasBias = False
+    init = None
     weight = None
+    bias = None
+    params = None
+    instrumentation = None
+    _workspace = None
 
-    def __init__(self, layer_sizes):
+    def __init__(self, layer_sizes, params=None, dtype=np.float64, activation=None, loss=None, bias=False,
+                 init=NORMAL_INIT, seed=None):
         """Constructor
 
         Params:
             tuple: Floats; First element is the input layer, last element is the output layer,
             and every other layer acts as an input layer
+            ndarray: 1-D array of weights adopted as the network's buffer without copying
+                        (see set_params with copy=False). None initializes random weights.
+            dtype: Type of the weights and of every computation, e.g. np.float32 to halve memory
+            str or list: Name of the activation of every layer, or a list with one name per set of weights
+                            (see activations.ACTIVATIONS). None uses the sigmoid everywhere.
+            str: Name of the loss (see activations.LOSSES). None picks the cost with cost_function_type and
+                    backpropagates the unscaled sum of squares derivative.
+            bool: Adds a bias vector to every layer, stored after its set of weights in the flat parameters
+            str: Scaling of the random weights; ForwardNN.NORMAL_INIT (unscaled standard normal),
+                    ForwardNN.XAVIER_INIT (variance 2 / (fan_in + fan_out), for sigmoid and tanh layers) or
+                    ForwardNN.HE_INIT (variance 2 / fan_in, for ReLU layers). Biases start at zero.
+            int: Seed of the random weights; None draws from the global numpy random state
         """
         # Define each layer
         self.inputLayerSize = layer_sizes[0]
         self.outputLayerSize = layer_sizes[len(layer_sizes) - 1]
         self.hiddenLayerSizes = layer_sizes[1:len(layer_sizes) - 1]
 
-        # Set each weight depending on the number of each layer being paired
-        self.weight = []
-
-        # If there are hidden layers
-        if len(self.hiddenLayerSizes) != 0:
-            # Add random weights from input layer to hidden layer 0
-            self.weight.append(np.random.randn(self.inputLayerSize, self.hiddenLayerSizes[0]))
-            # For each hidden layer
-            for i in range(len(self.hiddenLayerSizes) - 1):
-                # Add random weights between each hidden layer
-                self.weight.append(np.random.randn(self.hiddenLayerSizes[i], self.hiddenLayerSizes[i + 1]))
-            # Add random weights between the last hidden layer and output layer
-            self.weight.append(
-                np.random.randn(self.hiddenLayerSizes[len(self.hiddenLayerSizes) - 1], self.outputLayerSize))
-        else:
-            # Add random weights between the input layer and output layer
-            self.weight.append(np.random.randn(self.inputLayerSize, self.outputLayerSize))
+        # Shape of each set of weights depending on the number of each layer being paired
+        self.layerSizes = (self.inputLayerSize,) + tuple(self.hiddenLayerSizes) + (self.outputLayerSize,)
+        sizes = self.layerSizes
+        shapes = [(sizes[i], sizes[i + 1]) for i in range(len(sizes) - 1)]
+        self._shapes = shapes
+        self.hasBias = bool(bias)
+
+        # Every set of weights and biases lives in one contiguous buffer, self.weight and self.bias hold
+        # reshaped views into it
+        self.dtype = np.dtype(dtype)
+        count = sum(rows * cols + (cols if self.hasBias else 0) for rows, cols in shapes)
+        self.params = np.empty(count, dtype=self.dtype)
+        self._grad = np.empty(self.params.size, dtype=self.dtype)
+        self.weight, self.bias = self._views(self.params)
+        self._grad_weight, self._grad_bias = self._views(self._grad)
+
+        # Activation of each layer and the loss
+        # A single name may be unicode on Python 2 (e.g. read back from JSON), so only lists are per layer
+        if activation is None or not isinstance(activation, (list, tuple)):
+            activation = [activation or activations.Sigmoid.name] * len(shapes)
+        if len(activation) != len(shapes):
+            raise ValueError("Need one activation for each of the " + str(len(shapes)) + " sets of weights")
+        self.activation = [activations.get_activation(name) for name in activation]
+        self.loss = None if loss is None else activations.get_loss(loss)
+
+        if params is not None:
+            self.init = init
+            self.set_params(params, copy=False)
+            return
+
+        # Add random weights between each pair of layers
+        self.init = init
+        random = np.random if seed is None else np.random.RandomState(seed)
+        for weight in self.weight:
+            weight[...] = random.randn(*weight.shape)
+            if init != self.NORMAL_INIT:
+                weight *= self._init_scale(init, *weight.shape)
+        if self.hasBias:
+            for bias in self.bias:
+                bias.fill(0)
+
+    @classmethod
+    def _init_scale(cls, init, fan_in, fan_out):
+        """Standard deviation of the random weights of a layer
+
+        Returns:
+            float: Scale applied to standard normal weights
+        """
+        if init == cls.NORMAL_INIT:
+            return 1.0
+        elif init == cls.XAVIER_INIT:
+            return np.sqrt(2.0 / (fan_in + fan_out))
+        elif init == cls.HE_INIT:
+            return np.sqrt(2.0 / fan_in)
+        raise ValueError("Unknown initialization " + str(init) + "; choose from " +
+                         ", ".join((cls.NORMAL_INIT, cls.XAVIER_INIT, cls.HE_INIT)))
+
+    def _views(self, buf):
+        """Splits a 1-D buffer into reshaped views of each set of weights, each followed by its biases
+
+        Returns:
+            list: ndarray; Views of each set of weights sharing memory with buf
+            list: ndarray; Views of each bias vector sharing memory with buf, None without biases
+        """
+        weights = []
+        biases = [] if self.hasBias else None
+        start = 0
+        for rows, cols in self._shapes:
+            weights.append(buf[start:start + rows * cols].reshape(rows, cols))
+            start += rows * cols
+            if biases is not None:
+                biases.append(buf[start:start + cols])
+                start += cols
+        return weights, biases
+
+    def allocate_workspace(self, rows):
+        """Allocates reusable activation buffers for inputs of a fixed number of rows
+
+        While a workspace is allocated, forward and cost_function_prime on inputs with that many rows
+        reuse these buffers instead of allocating new arrays, and the output of forward is a buffer
+        that is overwritten on the next call.
+
+        Params:
+            int: Number of rows (data points) of the inputs that will use the workspace
+        """
+        sizes = [w.shape[1] for w in self.weight]
+        threshold = [np.empty((rows, size), dtype=self.dtype) for size in sizes]
+        self._workspace = {
+            'rows': rows,
+            'inputSum': [np.empty((rows, size), dtype=self.dtype) for size in sizes],
+            'threshold': threshold,
+            'hidden': threshold[:-1],
+            'delta': [np.empty((rows, size), dtype=self.dtype) for size in sizes],
+            'scratch': [np.empty((rows, size), dtype=self.dtype) for size in sizes],
+        }
+
+    def release_workspace(self):
+        """Frees the buffers of allocate_workspace; forward allocates new arrays again"""
+        self._workspace = None
+
+    def has_workspace(self, rows):
+        """Returns whether a workspace is allocated for inputs of the given number of rows
+
+        Returns:
+            bool: True if forward on such inputs runs in place
+        """
+        return self._workspace is not None and self._workspace['rows'] == rows
+
+    def cast(self, matrix):
+        """Converts data to the dtype of the network, without copying if it already matches
+
+        Compact inputs (sparse matrices and PackedBits, see the inputs module) stay compact.
+
+        Returns:
+            ndarray: matrix as an array of the network's dtype
+        """
+        if inputs.is_compact(matrix):
+            return inputs.as_input(matrix, self.dtype)
+        return np.asarray(matrix, dtype=self.dtype)
 
     def forward(self, input_matrix):
         """Feeds the input forward through the neural network
 
+        The input may also be a scipy.sparse matrix or inputs.PackedBits, read only by the first layer.
+
         Returns:
              ndarray: Output of our inputted matrix that is [n, 10] (n being the # of inputs)
         """
+        input_matrix = self.cast(input_matrix)
+        if self.has_workspace(input_matrix.shape[0]):
+            return self._forward_workspace(input_matrix)
+
         # Values taken from each set of weights * input summed together
         self.inputSum = []
-        # The inputSums inserted into the threshold function (sigmoid)
+        # The inputSums inserted into the threshold function (activation)
         self.threshold = []
 
         # Append each inputSum value matrix
-        self.inputSum.append(np.dot(input_matrix, self.weight[0]))
+        self.inputSum.append(self._input_sum(input_matrix, 0))
         for i in range(len(self.weight) - 1):
-            # Append each A value from the sigmoid(Z)
-            self.threshold.append(self.sigmoid(self.inputSum[i]))
-            self.inputSum.append(np.dot(self.threshold[i], self.weight[i + 1]))
-        y_hat = self.sigmoid(self.inputSum[len(self.inputSum) - 1])
+            # Append each A value from the activation(Z)
+            self.threshold.append(self.activation[i].forward(self.inputSum[i]))
+            self.inputSum.append(self._input_sum(self.threshold[i], i + 1))
+        y_hat = self.activation[-1].forward(self.inputSum[len(self.inputSum) - 1])
         return y_hat
 
+    def _input_sum(self, a, i, out=None):
+        """Sums the previous activations a through the i-th set of weights, plus its biases
+
+        Returns:
+            ndarray: out, or a new array when out is None
+        """
+        z = self._dot(a, self.weight[i], out)
+        if self.hasBias:
+            z += self.bias[i]
+        return z
+
+    def _forward_workspace(self, input_matrix):
+        """Feeds the input forward writing every inputSum and threshold into the workspace buffers
+
+        Returns:
+             ndarray: Output buffer of the workspace
+        """
+        ws = self._workspace
+        self.inputSum = ws['inputSum']
+        self.threshold = ws['hidden']
+
+        a = input_matrix
+        for i in range(len(self.weight)):
+            z = self._input_sum(a, i, self.inputSum[i])
+            a = self.activation[i].forward(z, ws['threshold'][i])
+        return a
+
+    def predict(self, input_matrix, batch_size=None, dtype=None):
+        """Feeds the input forward for inference only
+
+        Unlike forward, no inputSum or threshold is kept on the network: each layer is computed into one
+        of two rolling buffers, so the network can serve many threads at once.
+
+        Params:
+            ndarray: Input; Should match [n, InputLayerSize]. May also be a scipy.sparse matrix or inputs.PackedBits
+            int: Forwards at most this many rows at a time to bound peak memory; None forwards all at once
+            dtype: Type used for the computation, e.g. np.float32; None keeps the type of the weights
+
+        Returns:
+             ndarray: Output of our inputted matrix that is [n, OutputLayerSize]
+        """
+        dtype = np.dtype(dtype or self.dtype)
+        weights = [w if w.dtype == dtype else w.astype(dtype) for w in self.weight]
+        if self.hasBias:
+            biases = [b if b.dtype == dtype else b.astype(dtype) for b in self.bias]
+
+        # Sparse formats such as COO cannot be sliced, so compact inputs are converted once, to CSR
+        compact = inputs.is_compact(input_matrix)
+        if compact:
+            input_matrix = inputs.as_input(input_matrix, dtype)
+        rows = input_matrix.shape[0]
+        chunk = min(batch_size or rows, rows) or 1
+        output = np.empty((rows, self.outputLayerSize), dtype=dtype)
+
+        # Two flat buffers wide enough for any hidden layer; each layer reads one and writes the other
+        width = max([w.shape[1] for w in weights[:-1]] or [0])
+        buffers = [np.empty(chunk * width, dtype=dtype) for _ in range(2)]
+
+        for start in range(0, rows, chunk):
+            end = min(start + chunk, rows)
+            a = input_matrix[start:end]
+            if not compact:
+                a = np.asarray(a, dtype=dtype)
+            for i, w in enumerate(weights):
+                if i == len(weights) - 1:
+                    out = output[start:end]
+                else:
+                    out = buffers[i % 2][:(end - start) * w.shape[1]].reshape(end - start, w.shape[1])
+                z = self._dot(a, w, out)
+                if self.hasBias:
+                    z += biases[i]
+                a = self.activation[i].forward(z, out)
+        return output
+
     @staticmethod
     def sigmoid(z):
         """Static Sigmoid Function
@@ -80,7 +295,8 @@ class ForwardNN(object):
         Returns:
             ndarray: floats
         """
-        return 1 / (1 + np.exp(-(z.clip(-100, 100))))
+        limit = activations.sigmoid_limit(z.dtype)
+        return 1 / (1 + np.exp(-(z.clip(-limit, limit))))
 
     def sigmoid_prime(self, z):
         """Derivative of the Sigmoid Function
@@ -93,6 +309,20 @@ class ForwardNN(object):
         """
         return np.multiply(self.sigmoid(z), (1 - self.sigmoid(z)))
 
+    @staticmethod
+    def sigmoid_prime_output(a):
+        """Derivative of the Sigmoid Function taken from its output
+
+        Uses the already computed activation a = sigmoid(z), so no exponentials are evaluated again.
+
+        Params:
+            ndarray: floats; Output of the sigmoid function
+
+        Returns:
+            ndarray: floats
+        """
+        return np.multiply(a, (1 - a))
+
     @staticmethod
     def tanh(z):
         """Static Tanh Function
@@ -115,7 +345,19 @@ class ForwardNN(object):
         Returns:
             ndarray: floats
         """
-        return np.multiply(((2 * np.cosh(z))/(np.cosh(2 * z) + 1)), ((2 * np.cosh(z))/(np.cosh(2 * z) + 1)))
+        return 1 - np.power(np.tanh(z), 2)
+
+    @staticmethod
+    def tanh_prime_output(a):
+        """Tanh Derivative Function taken from its output a = tanh(z)
+
+        Params:
+            ndarray: floats; Output of the tanh function
+
+        Returns:
+            ndarray: floats
+        """
+        return 1 - np.multiply(a, a)
 
     def cost_function(self, x, y):
         """The cost function that compares the expected output with the actual output for training
@@ -131,15 +373,26 @@ class ForwardNN(object):
             float: Cost of the training data
         """
         y_hat = self.forward(x)
+        return self._cost(x, y, y_hat)
+
+    def _cost(self, x, y, y_hat):
+        """Computes the cost from an already forwarded output
+
+        Returns:
+            None: If invalid training data
+            float: Cost of the training data
+        """
         if y.shape[0] == x.shape[0]:
-            type = self.cost_function_type(x, y)
-            if type == self.SUM_OF_SQUARES_TYPE:
-                return self._sum_of_squares(y, y_hat)
-            elif type == self.CROSS_ENTROPY_TYPE:
-                return self._cross_entropy(y, y_hat)
+            if self.loss is not None:
+                return self.loss.value(y, y_hat)
+            loss = self._LEGACY_LOSSES.get(self.cost_function_type(x, y))
+            if loss is not None:
+                return loss.value(y, y_hat)
         return None
 
     def cost_function_type(self, x, y):
+        if self.loss is not None:
+            return self.loss.name
         if y.shape[1] == 1:
             return self.SUM_OF_SQUARES_TYPE
         elif y.shape[1] > 1:
@@ -147,148 +400,274 @@ class ForwardNN(object):
         else:
             return None
 
-    def _cross_entropy(self, y, y_hat):
-        """A type of cost function used for classification greater than 2.
+    # Kept for callers of ForwardNN.safe_log
+    safe_log = staticmethod(activations.safe_log)
+
+    def cost_function_prime(self, x, y):
+        """The derivative of the cost function
+
+        Uses the derived cost function to retrieve the gradient for each component. x may be a
+        scipy.sparse matrix or inputs.PackedBits, as in forward.
 
         Returns:
-            float: Cost of current neural network.
+            list: ndarray; Returns a list of matricies where each matrix represent a specific component.
+                    Gradients of the biases are only part of compute_gradients.
         """
-        return -1 * np.sum(np.multiply(y, self.safe_log(y_hat)) + np.multiply(1 - y, self.safe_log(1 - y_hat))) / y.shape[0]
+        x = self.cast(x)
+        y_hat = self._timed(instrumentation.FORWARD, self.forward, x)
+        return self._timed(instrumentation.BACKWARD, self._backward, x, self.cast(y), y_hat)
 
-    @staticmethod
-    def safe_log(x, min_val=0.0000000001):
-        """A log function used to cap ndarray x when having low or nan elements
+    def _backward(self, x, y, y_hat):
+        """Backpropagates the error of an already forwarded output
+
+        Reuses the activations cached by forward, so no activation is evaluated again. With a workspace
+        for these rows, the deltas are written into its buffers instead of new arrays.
 
         Returns:
-            ndarray: Natural log of x matrix
+            list: ndarray; Gradient of each set of weights, starting from the output layer
         """
-        return np.log(x.clip(min=min_val))
+        ws = self._workspace if self.has_workspace(x.shape[0]) else None
+        delta_buffer = ws['delta'] if ws is not None else [None] * len(self.weight)
+        scratch = ws['scratch'] if ws is not None else [None] * len(self.weight)
+        last = len(self.weight) - 1
+
+        # Derivative of cost function * derivative of threshold function(z)
+        if self.loss is None:
+            delta = np.subtract(y_hat, y, out=delta_buffer[last])
+            delta = self.activation[last].backward(y_hat, delta, delta, scratch[last])
+        else:
+            delta = self.loss.delta(y, y_hat, self.activation[last], delta_buffer[last], scratch[last])
+        derived = []
+
+        # Loop for each set of weights after the first, writing straight into the gradient buffer
+        for i in range(last, 0, -1):
+            derived.append(self._dot(self.threshold[i - 1].T, delta, self._grad_weight[i]))
+            if self.hasBias:
+                np.sum(delta, axis=0, out=self._grad_bias[i])
+            delta = self._dot(delta, self.weight[i].T, delta_buffer[i - 1])
+            delta = self.activation[i - 1].backward(self.threshold[i - 1], delta, delta, scratch[i - 1])
+
+        # Final set of weights with input
+        if inputs.is_compact(x):
+            derived.append(inputs.transpose_dot(x, delta, self._grad_weight[0]))
+        else:
+            derived.append(self._dot(x.T, delta, self._grad_weight[0]))
+        if self.hasBias:
+            np.sum(delta, axis=0, out=self._grad_bias[0])
+        return derived
 
     @staticmethod
-    def _sum_of_squares(y, y_hat):
-        """A cost function used for regression or binary classification
+    def _dot(a, b, out):
+        """Matrix product written into a preallocated array
+
+        Falls back to a copy when np.dot cannot write into out directly (e.g. mismatched dtypes).
+        Compact inputs go through the sparse and packed kernels of the inputs module.
 
         Returns:
-            float: Cost of current neural network.
+            ndarray: out, or a new array when out is None
         """
-        return np.sum(np.power(y - y_hat, 2)) / y.shape[0]
+        if inputs.is_compact(a):
+            return inputs.dot(a, b, out)
+        if out is None:
+            return np.dot(a, b)
+        try:
+            return np.dot(a, b, out=out)
+        except ValueError:
+            out[...] = np.dot(a, b)
+            return out
 
-    def cost_function_prime(self, x, y):
-        """The derivative of the cost function
+    def compute_gradients(self, x, y):
+        """Returns the gradients from each layer of computation
 
-        Uses the derived cost function to retrieve the gradient for each component
+        The returned array is a buffer owned by the network and is overwritten on the next call.
 
         Returns:
-            list: ndarray; Returns a list of matricies where each matrix represent a specific component
+            ndarray: 1-D array of floats containing the gradient values
         """
-        y_hat = self.forward(x);
+        # Obtains the derived costs over each derived weight set, stored in the flat gradient buffer
+        self.cost_function_prime(x, y)
+        return self._grad
 
-        delta = []
-        derived = []
-        if len(self.weight) > 1:
-            # Derivative of cost function * derivative of threshold function(z)
-            delta.append(np.multiply(-(y-y_hat), self.sigmoid_prime(self.inputSum[len(self.inputSum) - 1])))
-            derived.append(np.dot(self.threshold[len(self.threshold) - 1].T, delta[len(delta) - 1]))
-
-            # Loop for each set of weights
-            for i in range(2, len(self.inputSum)):
-                delta.append(np.array(np.dot(delta[len(delta) - 1], self.weight[len(self.weight) - i + 1].T)) *
-                             np.array(self.sigmoid_prime(self.inputSum[len(self.inputSum) - i])))
-                derived.append(np.dot(self.threshold[len(self.threshold) - i].T, delta[len(delta) - 1]))
-
-            # Final set of weights with input
-            delta.append(np.array(np.dot(delta[len(delta) - 1], self.weight[1].T)) *
-                         np.array(self.sigmoid_prime(self.inputSum[0])))
-            derived.append(np.dot(x.T, delta[len(delta) - 1]))
-        else:
-            # Derivative of cost function * derivative of threshold function(z)
-            delta.append(np.multiply(-(y-y_hat), self.sigmoid_prime(self.inputSum[len(self.inputSum) - 1])))
-            derived.append(np.dot(x.T, delta[len(delta) - 1]))
-        return derived
+    def value_and_grad(self, params, x, y):
+        """Sets the weights and returns the cost with its gradients using a single forward pass
 
+        Params:
+            ndarray: 1-D array of weights, laid out as in get_params
+            ndarray: Input; Should match [n, InputLayerSize]
+            ndarray: Output; Should match [n, OutputLayerSize]
 
-    def compute_gradients(self, x, y):
-        """Returns the gradients from each layer of computation
+        Returns:
+            float: Cost of the training data
+            ndarray: 1-D array of gradients; Buffer owned by the network, overwritten on the next call
+        """
+        self._timed(instrumentation.SET_PARAMS, self.set_params, params)
+        x = self.cast(x)
+        y = self.cast(y)
+        y_hat = self._timed(instrumentation.FORWARD, self.forward, x)
+        cost = self._timed(instrumentation.COST, self._cost, x, y, y_hat)
+        self._timed(instrumentation.BACKWARD, self._backward, x, y, y_hat)
+        return cost, self._grad
+
+    def _timed(self, phase, func, *args):
+        """Calls func(*args), timing it as the phase when the network is instrumented
 
         Returns:
-            ndarray: 1-D array of floats containing the gradient values
+            Return value of func
         """
-        # Obtains the derived costs over each derived weight set
-        derived = self.cost_function_prime(x, y)
+        if self.instrumentation is None:
+            return func(*args)
+        return self.instrumentation.timed(phase, func, *args)
 
-        # Unravels the derived cost for each set of weights and concatenates them all together
-        params = derived[len(derived) - 1].ravel();
+    def get_config(self):
+        """Returns the settings needed to build another network like this one
 
-        # Concatenates the gradients
-        for i in range(len(derived) - 1):
-            params = np.concatenate((params.ravel(), derived[len(derived) - 2 - i].ravel()))
-        return params
+        Returns:
+            dict: Keyword arguments of the constructor besides the layer sizes and weights
+        """
+        return {
+            'dtype': self.dtype,
+            'activation': [a.name for a in self.activation],
+            'loss': None if self.loss is None else self.loss.name,
+            'bias': self.hasBias,
+            'init': self.init,
+        }
 
     def get_params(self):
         """Returns the weights in a 1-D array
 
+        The array is the network's own buffer, so no copy is made; copy it to keep a snapshot.
+
         Returns:
-            ndarray: 1-D array of floats containing the weights. Size of array is [1, n]
+            ndarray: 1-D array of floats containing the weights. Size of array is [n]
                         where n = InputLayerSize * HiddenLayerSize[0] +
                                     range(0,lastHiddenLayer - 1) for HiddenLayerSize[i-1] * HiddenLayerSize[i+1] +
                                     HiddenLayerSize[lastHiddenLayer] * OutputLayerSize
+                        plus, with biases, the # of hidden and output nodes. Each set of weights
+                        is followed by the biases of the layer it feeds.
         """
-        params = None
-        for i in range(len(self.weight)):
-            if params is None:
-                params = self.weight[i].ravel()
-            elif len(params.shape) == 1:
-                params = np.concatenate((params.ravel(), self.weight[i].ravel()))
-            else:
-                params = np.concatenate((params.ravel(), self.weight[i].ravel()), axis=1)
-        if len(params.shape) == 2 and params.shape[0] == 1:
-            return params.T
-        return params
+        return self.params
 
-    def set_params(self, params):
+    def set_params(self, params, copy=True):
         """Sets the weights of the Neural Network from a 1-D array
 
         Params:
-            ndarray: 1-D array of floats that are the weights. Size of array is [1, n]
+            ndarray: 1-D array of floats that are the weights. Size of array is [n]
                         where n = InputLayerSize * HiddenLayerSize[0] +
                                     range(0,lastHiddenLayer - 1) for HiddenLayerSize[i-1] * HiddenLayerSize[i+1] +
                                     HiddenLayerSize[lastHiddenLayer] * OutputLayerSize
+                        plus, with biases, the # of hidden and output nodes (laid out as in get_params)
+            bool: If False, the network adopts params as its buffer instead of copying it.
+                    params must then be a contiguous 1-D array of exactly n floats.
         """
-        # Starting position of first set of weights
-        hiddenStart = 0
-        if len(self.weight) > 1:
-            # Ending position of first set of weights
-            hiddenEnd = self.hiddenLayerSizes[0] * self.inputLayerSize
-            # Sets the first set of weights
-            self.weight[0] = np.reshape(params[hiddenStart:hiddenEnd], (self.inputLayerSize, self.hiddenLayerSizes[0]))
-
-            # for each hidden layer
-            for layer in range(0, len(self.hiddenLayerSizes) - 1):
-                # new start position is the previous end position
-                hiddenStart = hiddenEnd
-                # set new end position
-                hiddenEnd = hiddenStart + self.hiddenLayerSizes[layer] * self.hiddenLayerSizes[layer + 1]
-                # Sets the set of weights to weight list
-                self.weight[layer + 1] = np.reshape(params[hiddenStart:hiddenEnd],
-                                           (self.hiddenLayerSizes[layer], self.hiddenLayerSizes[layer + 1]))
-            # Setting the final set of weights to output
-            hiddenStart = hiddenEnd
-            hiddenEnd = hiddenStart + self.hiddenLayerSizes[len(self.hiddenLayerSizes) - 1] * self.outputLayerSize
-            self.weight[len(self.weight) - 1] = np.reshape(params[hiddenStart:hiddenEnd],
-                                            (self.hiddenLayerSizes[len(self.hiddenLayerSizes) - 1], self.outputLayerSize))
+        if params is self.params:
+            return
+        if copy:
+            self.check_writeable()
+            np.copyto(self.params, np.ravel(params)[:self.params.size])
         else:
-            hiddenEnd = self.inputLayerSize * self.outputLayerSize
-            self.weight[0] = np.reshape(params[hiddenStart:hiddenEnd], (self.inputLayerSize, self.outputLayerSize))
+            if (params.ndim != 1 or params.size != self.params.size or not params.flags['C_CONTIGUOUS'] or
+                    params.dtype != self.dtype):
+                raise ValueError("Parameter buffer must be a contiguous 1-D array of " + str(self.params.size) +
+                                 " " + self.dtype.name)
+            self.params = params
+            self.weight, self.bias = self._views(self.params)
+
+
+    def check_writeable(self):
+        """Raises a ValueError if the weight buffer cannot be written, e.g. a checkpoint mapped read-only"""
+        if not self.params.flags.writeable:
+            raise ValueError("The weights of this network are read-only; load its checkpoint with mode='c' "
+                             "(copy-on-write) to change or train them")
+
+
+class _EarlyStop(Exception):
+    """Raised by the iteration callback to end a full-batch minimization"""
 
 
 class Trainer(object):
-    def __init__(self, N):
+    # CONSTANTS
+    BFGS = "BFGS"
+    L_BFGS_B = "L-BFGS-B"
+
+    def __init__(self, N, optimizer=None, batch_size=32, epochs=10, shuffle=True, seed=None,
+                 method=BFGS, maxiter=200, history=10, bounds=None, mixed_precision=False, instrumentation=None,
+                 validation=None, validation_frequency=1, patience=None, min_delta=0.0, restore_best=True,
+                 data_parallel=None):
         """Constructor
 
         Params:
             NeuralNetwork: Sets neural network to be trained.
+            Optimizer: Stochastic optimizer from the optimizers module used for mini-batch training.
+                        None trains on the full data with method.
+            int: Number of data points in each mini-batch
+            int: Number of passes over the data during mini-batch training
+            bool: Shuffles the data points before each epoch
+            int: Seed of the shuffling
+            str: Full-batch method, Trainer.BFGS or Trainer.L_BFGS_B. BFGS keeps a dense
+                    n_params x n_params inverse Hessian; L-BFGS-B only keeps history pairs of vectors.
+            int: Maximum # of iterations of the full-batch method
+            int: Number of correction pairs kept by L-BFGS-B
+            tuple: (min, max) bounds applied to every weight, or a sequence of (min, max) per weight.
+                    Only supported by L-BFGS-B; None for unbounded weights.
+            bool: Mini-batch optimizers step a float64 master copy of the weights while the network computes
+                    in its own dtype. The full-batch methods always keep a float64 master copy.
+            Instrumentation: Records the phase timings and the telemetry of every iteration of train (every
+                                epoch for mini-batch training); see the instrumentation module. None records nothing.
+            tuple: (input, expected output) held out from training, whose cost is evaluated every
+                    validation_frequency iterations. None trains without validation.
+            int: # of iterations (epochs for mini-batch training) between validation evaluations
+            int: Stops training after this many validation evaluations in a row without improvement;
+                    None never stops early
+            float: Decrease of the validation cost below the best one needed to count as an improvement
+            bool: Ends training with the weights of the lowest validation cost instead of the last weights
+            int: Shards the data over this many worker processes, which compute the cost and gradient of
+                    every full-batch evaluation in parallel (see the parallel module); 0 uses every core.
+                    None evaluates in this process.
         """
+        if bounds is not None and method != self.L_BFGS_B:
+            raise ValueError("Bounds on the weights require the " + self.L_BFGS_B + " method")
+        if patience is not None and validation is None:
+            raise ValueError("Early stopping requires a validation set")
+        if data_parallel is not None and optimizer is not None:
+            raise ValueError("Data-parallel evaluation is only supported by the full-batch methods")
+
         self.neural_net = N
+        self.optimizer = optimizer
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
+        self.method = method
+        self.maxiter = maxiter
+        self.history = history
+        self.bounds = bounds
+        self.mixed_precision = mixed_precision
+        self.instrumentation = instrumentation
+        self.validation = validation
+        self.validation_frequency = validation_frequency
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best = restore_best
+        self.data_parallel = data_parallel
+
+        # Outcome of the last call to train
+        self.result = None
+        self.iterations = None
+        self.evaluations = None
+        self.converged = None
+        self.message = None
+        # Training cost of the final weights, known without another forward pass; None when unknown
+        self.cost = None
+        # Lowest validation cost, the iteration (epoch) it was reached at, and whether patience ran out
+        self.validation_cost = None
+        self.best_iteration = None
+        self.stopped_early = False
+        # Bookkeeping of cost_function_wrapper, which can also be called outside of train; reset by train
+        self._evaluations = 0
+        self._evaluation_cost = None
+        self._grad_norm = None
+        # Data-parallel evaluator, only running during train
+        self._evaluator = None
 
     def cost_function_wrapper(self, params, x, y):
         """Used to set the parameters of the Neural Network being trained
@@ -297,14 +676,24 @@ class Trainer(object):
             float: Cost of the current Neural Network
             ndarray: 1-D array of gradients
         """
-        # Sets the parameters
-        self.neural_net.set_params(params)
-        # Gets the cost
-        cost = self.neural_net.cost_function(x, y)
-        # Obtain the derived cost for each derived weights
-        grad = self.neural_net.compute_gradients(x, y)
+        if self._evaluator is not None:
+            # Every worker computes its shard; the network itself is only set on accepted iterations
+            cost, grad = self.neural_net._timed(instrumentation.SHARDS, self._evaluator.value_and_grad, params)
+            self._evaluations += 1
+            self._evaluation_cost = cost
+            if self.instrumentation is not None:
+                self._grad_norm = float(np.linalg.norm(grad))
+            return cost, grad.copy()
 
-        return cost, grad
+        # Sets the parameters, gets the cost and the derived cost for each derived weights in one pass
+        cost, grad = self.neural_net.value_and_grad(params, x, y)
+        self._evaluation_cost = float(cost)
+        self._evaluations += 1
+        if self.instrumentation is not None:
+            self._grad_norm = float(np.linalg.norm(grad))
+
+        # The optimizer keeps previous gradients around, so it is handed its own float64 copy of the buffer
+        return float(cost), grad.astype(np.float64)
 
     def train(self, x, y):
         """Trains the Neural Network to fit the training data
@@ -315,14 +704,336 @@ class Trainer(object):
             ndarray: Input value for the Neural Network
             ndarray: Expected output value from the Neural Network
         """
-        # Parameters of weights from the Neural Network
+        # Converts the data once instead of on every evaluation
+        x = self.neural_net.cast(x)
+        y = self.neural_net.cast(y)
+
+        self._start()
+        try:
+            if self.optimizer is not None:
+                return self._train_mini_batch(x, y)
+            return self._train_full_batch(x, y, self.maxiter)
+        finally:
+            self._stop()
+
+    def partial_fit(self, x, y, steps=10, replay=None, replay_size=None):
+        """Updates the Neural Network from a few new data points, starting from its current weights
+
+        The update batch holds the new data points plus a sample of the replay buffer, which keeps the
+        network from forgetting the data it learned before; the new data points are added to the buffer
+        afterwards. Mini-batch optimizers take steps on the batch and keep their state (momentum, moments,
+        step count) from one call to the next. The full-batch methods run up to steps iterations on it.
+
+        Params:
+            ndarray: New inputs, [n, InputLayerSize] or a single input
+            ndarray: Expected outputs of the new inputs
+            int: # of optimizer steps, or of full-batch iterations
+            ReplayBuffer: Past data points mixed into the update (see the replay module); None only uses the new ones
+            int: # of past data points mixed in; None uses batch_size
+        """
+        new_x = np.atleast_2d(self.neural_net.cast(x))
+        new_y = np.atleast_2d(self.neural_net.cast(y))
+        if new_x.shape[0] != new_y.shape[0]:
+            raise ValueError("Need equal number of Inputs and Outputs")
+
+        x, y = new_x, new_y
+        if replay is not None and len(replay):
+            past_x, past_y = replay.sample(self.batch_size if replay_size is None else replay_size)
+            x = np.concatenate((new_x, self.neural_net.cast(past_x)))
+            y = np.concatenate((new_y, self.neural_net.cast(past_y)))
+
+        self._start()
+        try:
+            if self.optimizer is not None:
+                self._online_steps(x, y, steps)
+            else:
+                self._train_full_batch(x, y, steps)
+        finally:
+            self._stop()
+
+        if replay is not None:
+            replay.add(new_x, new_y)
+
+    def _online_steps(self, x, y, steps):
+        """Takes steps of the stochastic optimizer on one batch without resetting it
+
+        Params:
+            ndarray: Input value for the Neural Network
+            ndarray: Expected output value from the Neural Network
+            int: # of steps
+        """
         params = self.neural_net.get_params()
+        if self.mixed_precision and params.dtype != np.float64:
+            params = params.astype(np.float64)
+
+        self.result = None
+        taken = 0
+        for step in range(steps):
+            cost, grad = self.neural_net.value_and_grad(params, x, y)
+            self._average(grad, x.shape[0])
+            grad_norm = float(np.linalg.norm(grad)) if self.instrumentation is not None else None
+            self.optimizer.step(params, grad)
+            taken = step + 1
+            self.neural_net.set_params(params)
+            if self._end_iteration(taken, params, float(cost), grad_norm, self.optimizer.iterations):
+                break
+
+        self.neural_net.set_params(params)
+        if self.validation is not None and self._validated != taken:
+            self._validate(taken, params, None)
+        self._restore_best()
+        self.iterations = self.evaluations = taken
+        self.converged = None
+        self.message = "Completed " + str(taken) + " online steps"
+        self.cost = None
+
+    def _train_full_batch(self, x, y, maxiter):
+        """Minimizes the cost over all the data with the full-batch method
+
+        Params:
+            ndarray: Input value for the Neural Network
+            ndarray: Expected output value from the Neural Network
+            int: Maximum # of iterations
+        """
+        # Parameters of weights from the Neural Network, as the float64 master copy the optimizer works on
+        params = self.neural_net.get_params().astype(np.float64)
 
         # Options: maximum # of iterations and show information display after minimizing
-        opt = {'maxiter': 200, 'disp': False}
+        opt = {'maxiter': maxiter, 'disp': False}
+        bounds = None
+        if self.method == self.L_BFGS_B:
+            # maxcor: # of correction pairs approximating the Hessian, memory is linear in the # of weights
+            opt['maxcor'] = self.history
+            bounds = self._bounds(params.size)
+
+        if self.data_parallel is not None:
+            self._evaluator = parallel.ShardedEvaluator(self.neural_net, x, y, self.data_parallel or None)
+            owns_workspace = False
+        else:
+            # Every evaluation has the same number of rows, so the activation buffers are allocated once
+            owns_workspace = not self.neural_net.has_workspace(x.shape[0])
+            if owns_workspace:
+                self.neural_net.allocate_workspace(x.shape[0])
+
+        try:
+            # jac: Jacobian (Defines that cost_function_wrapper returns gradients)
+            # method: BFGS or L-BFGS-B training and gradient descent
+            # callback: Sets the accepted weights, validates them and records the iteration
+            self.result = optimize.minimize(self.cost_function_wrapper, params, jac=True, method=self.method,
+                                            args=(x, y), bounds=bounds, options=opt, callback=self._iteration)
+        except _EarlyStop:
+            # The network already holds the weights of the last iteration
+            self.result = None
+        finally:
+            if owns_workspace:
+                self.neural_net.release_workspace()
+            if self._evaluator is not None:
+                self._evaluator.close()
+                self._evaluator = None
+
+        if self.result is None:
+            self.iterations = self._iterations
+            self.evaluations = self._evaluations
+            self.converged = False
+            self.message = ("Stopped early: no validation improvement in " + str(self.patience) +
+                            " evaluations")
+            self.cost = self._evaluation_cost
+        else:
+            # The last evaluation may be a rejected line search step, so the result is set explicitly
+            self.neural_net.set_params(self.result.x)
+            self.iterations = self.result.nit
+            self.evaluations = self.result.nfev
+            self.converged = bool(self.result.success)
+            self.message = self.result.message
+            self.cost = float(self.result.fun)
+            if self.validation is not None and self._validated != self.iterations:
+                self._validate(self.iterations, self.result.x, self.cost)
+        self._restore_best()
+
+    def _start(self):
+        """Resets the outcome and the validation state, and starts the instrumentation"""
+        self.neural_net.check_writeable()
+        self.iterations = self.evaluations = self.converged = self.message = self.cost = None
+        self.validation_cost = self.best_iteration = None
+        self.stopped_early = False
+        self._iterations = 0
+        self._evaluations = 0
+        self._evaluation_cost = None
+        self._grad_norm = None
+        self._best = None
+        self._best_cost = None
+        self._wait = 0
+        self._validated = None
+        self._evaluator = None
+        if self.validation is not None:
+            self._validation_data = (self.neural_net.cast(self.validation[0]),
+                                     self.neural_net.cast(self.validation[1]))
+
+        if self.instrumentation is not None:
+            self._previous = self.neural_net.instrumentation
+            self.neural_net.instrumentation = self.instrumentation
+            self.instrumentation.start()
+
+    def _stop(self):
+        """Records the summary of the training and restores the network's own instrumentation"""
+        self._best = None
+        self._validation_data = None
+        if self.instrumentation is None:
+            return
+        self.neural_net.instrumentation = self._previous
+        self.instrumentation.stop(iterations=self.iterations, evaluations=self.evaluations, converged=self.converged,
+                                  message=self.message, cost=self.cost, validation_cost=self.validation_cost,
+                                  best_iteration=self.best_iteration, stopped_early=self.stopped_early)
+
+    def _iteration(self, params):
+        """Callback of the full-batch methods: sets the accepted weights, validates them and records the iteration
+
+        The training cost is that of the latest evaluation, which is at the accepted weights.
+        """
+        self.neural_net._timed(instrumentation.SET_PARAMS, self.neural_net.set_params, params)
+        self._iterations += 1
+        if self._end_iteration(self._iterations, params, self._evaluation_cost, self._grad_norm, self._evaluations):
+            raise _EarlyStop()
+
+    def _end_iteration(self, iteration, params, cost, grad_norm, evaluations):
+        """Validates the weights when due and records the iteration
+
+        Returns:
+            bool: True if training should stop early
+        """
+        fields = {}
+        stop = False
+        if self.validation is not None and iteration % self.validation_frequency == 0:
+            stop = self._validate(iteration, params, cost)
+            fields['validation_cost'] = self._last_validation_cost
+        if self.instrumentation is not None:
+            self.instrumentation.iteration(iteration, cost=cost, grad_norm=grad_norm, evaluations=evaluations,
+                                           **fields)
+        return stop
+
+    def _validate(self, iteration, params, cost):
+        """Evaluates the validation cost of the network's current weights and keeps them if they are the best
+
+        Params:
+            int: Iteration (epoch) of the weights
+            ndarray: 1-D array of the weights, copied when they are the best
+            float: Training cost of the weights
+
+        Returns:
+            bool: True once patience validations in a row did not improve
+        """
+        self._validated = iteration
+        validation_cost = float(self.neural_net._timed(instrumentation.VALIDATION, self.neural_net.cost_function,
+                                                       *self._validation_data))
+        self._last_validation_cost = validation_cost
 
-        # jac: Jacobian (Defines that cost_function_wrapper returns gradients)
-        # BFGS: Uses BFGS method of training and gradient descent
-        # callback: Return values acts as parameter for set_params
-        optimize.minimize(self.cost_function_wrapper, params, jac=True, method='BFGS',
-                          args=(x, y), options=opt, callback=self.neural_net.set_params)
+        # A NaN best is replaced by any later cost; a NaN cost is never an improvement
+        if (self.validation_cost is None or np.isnan(self.validation_cost) or
+                validation_cost < self.validation_cost - self.min_delta):
+            self.validation_cost = validation_cost
+            self.best_iteration = iteration
+            self._best_cost = cost
+            self._wait = 0
+            if self.restore_best:
+                if self._best is None:
+                    self._best = np.array(params, dtype=np.float64)
+                else:
+                    np.copyto(self._best, params)
+            return False
+
+        self._wait += 1
+        if self.patience is not None and self._wait >= self.patience:
+            self.stopped_early = True
+            return True
+        return False
+
+    def _restore_best(self):
+        """Sets the weights with the lowest validation cost when asked to, along with their training cost"""
+        if self._best is None or self.best_iteration == self._validated:
+            # The network already holds the best weights
+            return
+        self.neural_net.set_params(self._best)
+        self.cost = self._best_cost
+
+    def _bounds(self, size):
+        """Converts the bounds given to the constructor for size weights
+
+        Returns:
+            None: If the weights are unbounded
+            Bounds: Lower and upper bound of every weight
+        """
+        if self.bounds is None:
+            return None
+        if len(self.bounds) == 2 and np.isscalar(self.bounds[0]) and np.isscalar(self.bounds[1]):
+            return optimize.Bounds(np.full(size, self.bounds[0]), np.full(size, self.bounds[1]))
+        low, high = np.array(self.bounds, dtype=float).T
+        return optimize.Bounds(low, high)
+
+    def _average(self, grad, rows):
+        """Turns the gradient of a batch into the mean gradient stepped by the stochastic optimizers
+
+        The gradients of a loss already are means over the batch; the legacy gradients are sums.
+        """
+        if self.neural_net.loss is None:
+            grad /= rows
+
+    def _train_mini_batch(self, x, y):
+        """Trains the Neural Network with the stochastic optimizer over shuffled mini-batches
+
+        Params:
+            ndarray: Input value for the Neural Network
+            ndarray: Expected output value from the Neural Network
+        """
+        rows = x.shape[0]
+        batch_size = min(self.batch_size, rows)
+        params = self.neural_net.get_params()
+        if self.mixed_precision and params.dtype != np.float64:
+            # The optimizer steps a float64 master copy; every evaluation casts it into the network
+            params = params.astype(np.float64)
+
+        # Full batches share one workspace; only a trailing partial batch allocates
+        owns_workspace = not self.neural_net.has_workspace(batch_size)
+        if owns_workspace:
+            self.neural_net.allocate_workspace(batch_size)
+
+        self.result = None
+        self.optimizer.reset()
+        epochs = 0
+        try:
+            for epoch in range(self.epochs):
+                order = self.random.permutation(rows) if self.shuffle else np.arange(rows)
+                costs = norms = 0.0
+                for start in range(0, rows, batch_size):
+                    batch = order[start:start + batch_size]
+                    cost, grad = self.neural_net.value_and_grad(params, x[batch], y[batch])
+                    self._average(grad, len(batch))
+                    costs += cost * len(batch)
+                    if self.instrumentation is not None:
+                        norms += np.linalg.norm(grad) * len(batch)
+                    # Updates the weights in place through the network's parameter buffer
+                    self.optimizer.step(params, grad)
+
+                # Costs are means over each batch, weighted by its size into the mean over the epoch
+                epochs = epoch + 1
+                self.neural_net.set_params(params)
+                grad_norm = float(norms / rows) if self.instrumentation is not None else None
+                if self._end_iteration(epochs, params, float(costs / rows), grad_norm, self.optimizer.iterations):
+                    break
+        finally:
+            if owns_workspace:
+                self.neural_net.release_workspace()
+
+        self.neural_net.set_params(params)
+        if self.validation is not None and self._validated != epochs:
+            self._validate(epochs, params, None)
+        self._restore_best()
+        self.iterations = self.optimizer.iterations
+        self.evaluations = self.optimizer.iterations
+        self.converged = None
+        if self.stopped_early:
+            self.message = ("Stopped early after " + str(epochs) + " epochs: no validation improvement in " +
+                            str(self.patience) + " evaluations")
+        else:
+            self.message = "Completed " + str(self.epochs) + " epochs"
+        # The mean batch cost drifts with the weights during an epoch, so the exact cost is left unknown
+        self.cost = None
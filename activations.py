@@ -0,0 +1,264 @@
+"""Registry of the activation and loss functions available to ForwardNN.
+
+Activations are looked up by name with get_activation and losses with get_loss. Every derivative is
+computed from the output the forward pass already cached, so no transcendental function is evaluated
+again during backpropagation, and every kernel can write into a preallocated array.
+"""
+import numpy as np
+
+__author__ = 'John Bucknam & Bill Clark'
+
+
+def sigmoid_limit(dtype):
+    """Largest |z| given to exp in the sigmoid: 100, or less where exp(100) overflows the dtype"""
+    if not np.issubdtype(dtype, np.floating):
+        return 100
+    return min(100, int(np.log(np.finfo(dtype).max)) - 1)
+
+
+class Activation(object):
+    """Element-wise activation function of a layer"""
+    name = None
+
+    def forward(self, z, out=None):
+        """Applies the activation to z
+
+        Params:
+            ndarray: Input sums of the layer
+            ndarray: Array the result is written into (may be z itself); None allocates one
+
+        Returns:
+            ndarray: Activations
+        """
+        raise NotImplementedError
+
+    def prime_output(self, a, out=None):
+        """Derivative of the activation, computed from its output a
+
+        Returns:
+            ndarray: Derivative at each element
+        """
+        raise NotImplementedError
+
+    def backward(self, a, grad, out=None, scratch=None):
+        """Backpropagates the derivative of the cost through the activation
+
+        Params:
+            ndarray: Output of the activation
+            ndarray: Derivative of the cost with respect to the output
+            ndarray: Array the result is written into (may be grad itself); None allocates one
+            ndarray: Array of the same shape used for intermediate values; None allocates one
+
+        Returns:
+            ndarray: Derivative of the cost with respect to the input sums
+        """
+        return np.multiply(grad, self.prime_output(a, scratch), out=out)
+
+
+class Sigmoid(Activation):
+    name = "sigmoid"
+
+    def forward(self, z, out=None):
+        if out is None:
+            out = np.empty_like(z)
+        limit = sigmoid_limit(out.dtype)
+        np.clip(z, -limit, limit, out=out)
+        np.negative(out, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    def prime_output(self, a, out=None):
+        out = np.subtract(1, a, out=out)
+        return np.multiply(a, out, out=out)
+
+
+class Tanh(Activation):
+    name = "tanh"
+
+    def forward(self, z, out=None):
+        return np.tanh(z, out=out)
+
+    def prime_output(self, a, out=None):
+        # 1 - tanh(z) ** 2
+        out = np.multiply(a, a, out=out)
+        return np.subtract(1, out, out=out)
+
+
+class ReLU(Activation):
+    name = "relu"
+
+    def forward(self, z, out=None):
+        return np.maximum(z, 0, out=out)
+
+    def prime_output(self, a, out=None):
+        if out is None:
+            return (a > 0).astype(a.dtype)
+        return np.greater(a, 0, out=out)
+
+
+class LeakyReLU(Activation):
+    name = "leaky_relu"
+
+    def __init__(self, alpha=0.01):
+        """Constructor
+
+        Params:
+            float: Slope for negative inputs, between 0 and 1
+        """
+        self.alpha = alpha
+
+    def forward(self, z, out=None):
+        # For 0 < alpha < 1, max(z, alpha * z) is z when positive and alpha * z otherwise
+        return np.maximum(z, self.alpha * z, out=out)
+
+    def prime_output(self, a, out=None):
+        # The output has the sign of the input
+        if out is None:
+            out = np.empty_like(a)
+        out.fill(self.alpha)
+        out[a > 0] = 1
+        return out
+
+
+class Softmax(Activation):
+    """Softmax over each row, normally used by the output layer with softmax_cross_entropy"""
+    name = "softmax"
+
+    def forward(self, z, out=None):
+        out = np.subtract(z, z.max(axis=1, keepdims=True), out=out)
+        np.exp(out, out=out)
+        out /= out.sum(axis=1, keepdims=True)
+        return out
+
+    def prime_output(self, a, out=None):
+        raise ValueError("The softmax derivative is not element-wise; use backward")
+
+    def backward(self, a, grad, out=None, scratch=None):
+        # Jacobian-vector product of the softmax: a * (grad - sum(grad * a))
+        dot = np.multiply(grad, a, out=scratch).sum(axis=1, keepdims=True)
+        out = np.subtract(grad, dot, out=out)
+        return np.multiply(out, a, out=out)
+
+
+class Loss(object):
+    """Cost function comparing the expected output y with the output y_hat, averaged over data points"""
+    name = None
+
+    def value(self, y, y_hat):
+        """Returns:
+            float: Cost of the outputs
+        """
+        raise NotImplementedError
+
+    def gradient(self, y, y_hat, out=None):
+        """Derivative of the cost with respect to y_hat
+
+        Returns:
+            ndarray: Same shape as y_hat
+        """
+        raise NotImplementedError
+
+    def delta(self, y, y_hat, activation, out=None, scratch=None):
+        """Derivative of the cost with respect to the input sums of the output layer
+
+        Combinations with a simple closed form override this instead of going through the activation.
+
+        Returns:
+            ndarray: Same shape as y_hat
+        """
+        return activation.backward(y_hat, self.gradient(y, y_hat, out), out, scratch)
+
+
+def safe_log(x, min_val=0.0000000001):
+    """A log function used to cap ndarray x when having low or nan elements
+
+    Returns:
+        ndarray: Natural log of x matrix
+    """
+    return np.log(x.clip(min=min_val))
+
+
+class SumOfSquares(Loss):
+    name = "sse"
+
+    def value(self, y, y_hat):
+        return np.sum(np.power(y - y_hat, 2)) / y.shape[0]
+
+    def gradient(self, y, y_hat, out=None):
+        out = np.subtract(y_hat, y, out=out)
+        out *= 2.0 / y.shape[0]
+        return out
+
+
+class CrossEntropy(Loss):
+    """Binary cross entropy of every output, for sigmoid outputs"""
+    name = "cross_entropy"
+
+    def value(self, y, y_hat):
+        return -1 * np.sum(np.multiply(y, safe_log(y_hat)) + np.multiply(1 - y, safe_log(1 - y_hat))) / y.shape[0]
+
+    def gradient(self, y, y_hat, out=None):
+        clipped = y_hat.clip(0.0000000001, 1 - 0.0000000001)
+        out = np.subtract(y_hat, y, out=out)
+        out /= clipped * (1 - clipped) * y.shape[0]
+        return out
+
+    def delta(self, y, y_hat, activation, out=None, scratch=None):
+        if isinstance(activation, Sigmoid):
+            # The sigmoid derivative cancels out
+            out = np.subtract(y_hat, y, out=out)
+            out /= y.shape[0]
+            return out
+        return super(CrossEntropy, self).delta(y, y_hat, activation, out, scratch)
+
+
+class SoftmaxCrossEntropy(Loss):
+    """Categorical cross entropy, for softmax outputs over one-hot expected outputs"""
+    name = "softmax_cross_entropy"
+
+    def value(self, y, y_hat):
+        return -1 * np.sum(np.multiply(y, safe_log(y_hat))) / y.shape[0]
+
+    def gradient(self, y, y_hat, out=None):
+        out = np.divide(y, y_hat.clip(min=0.0000000001), out=out)
+        out /= -y.shape[0]
+        return out
+
+    def delta(self, y, y_hat, activation, out=None, scratch=None):
+        if isinstance(activation, Softmax):
+            # The softmax Jacobian cancels out
+            out = np.subtract(y_hat, y, out=out)
+            out /= y.shape[0]
+            return out
+        return super(SoftmaxCrossEntropy, self).delta(y, y_hat, activation, out, scratch)
+
+
+ACTIVATIONS = dict((cls.name, cls) for cls in (Sigmoid, Tanh, ReLU, LeakyReLU, Softmax))
+LOSSES = dict((cls.name, cls) for cls in (SumOfSquares, CrossEntropy, SoftmaxCrossEntropy))
+
+
+def get_activation(name):
+    """Returns the activation registered under name; an Activation instance is returned as is
+
+    Returns:
+        Activation
+    """
+    if isinstance(name, Activation):
+        return name
+    if name not in ACTIVATIONS:
+        raise ValueError("Unknown activation " + str(name) + "; choose from " + ", ".join(sorted(ACTIVATIONS)))
+    return ACTIVATIONS[name]()
+
+
+def get_loss(name):
+    """Returns the loss registered under name; a Loss instance is returned as is
+
+    Returns:
+        Loss
+    """
+    if isinstance(name, Loss):
+        return name
+    if name not in LOSSES:
+        raise ValueError("Unknown loss " + str(name) + "; choose from " + ", ".join(sorted(LOSSES)))
+    return LOSSES[name]()
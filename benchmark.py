@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+"""Benchmarks for the hot paths of ForwardNN.
+
+Run `python benchmark.py -h` for the available benchmarks.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ForwardNN
+import activations
+import checkpoint
+import dataset
+import ensemble
+import parallel
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def synthetic_data(rows, inputs, outputs, seed=0):
+    """Random binary inputs with one-hot outputs, shaped like the PatternCell data
+
+    Returns:
+        ndarray: Inputs [rows, inputs]
+        ndarray: Outputs [rows, outputs]
+    """
+    rng = np.random.RandomState(seed)
+    x = rng.randint(0, 2, size=(rows, inputs)).astype(float)
+    y = np.zeros((rows, outputs))
+    y[np.arange(rows), rng.randint(0, outputs, size=rows)] = 1
+    return x, y
+
+
+def _measure(func, iterations, warmup=True):
+    """Runs func repeatedly, returning the seconds per call and the peak traced memory in bytes"""
+    if warmup:
+        func()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.time() - start) / iterations
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def allocation(layers, rows, iterations):
+    """Compares value_and_grad with and without a preallocated workspace
+
+    Returns:
+        dict: Seconds per evaluation and peak memory for each mode
+    """
+    x, y = synthetic_data(rows, layers[0], layers[-1])
+    NN = ForwardNN.ForwardNN(layers)
+    params = NN.get_params().copy()
+
+    results = {}
+    for mode in ('allocating', 'workspace'):
+        if mode == 'workspace':
+            NN.allocate_workspace(rows)
+        elapsed, peak = _measure(lambda: NN.value_and_grad(params, x, y), iterations)
+        results[mode] = {'seconds': elapsed, 'peak_bytes': peak}
+    NN.release_workspace()
+    return results
+
+
+def patterncell_data():
+    """Loads the PatternCell training data shipped with the repository
+
+    Returns:
+        ndarray: Inputs [n, 35]
+        ndarray: Outputs [n, 10]
+    """
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Problems", "PatternCell")
+    return np.loadtxt(os.path.join(base, "Inputs")), np.loadtxt(os.path.join(base, "Outputs"))
+
+
+def full_batch(layers, x, y, maxiter, history, max_bfgs_params, seed=0):
+    """Trains the same initial network with BFGS and L-BFGS-B
+
+    BFGS is skipped when the network has more than max_bfgs_params weights, as its dense
+    inverse Hessian alone would take 8 * n_params ** 2 bytes.
+
+    Returns:
+        dict: Seconds, peak memory, final cost, iterations and evaluations for each method
+    """
+    np.random.seed(seed)
+    initial = ForwardNN.ForwardNN(layers).get_params().copy()
+
+    results = {}
+    for method in (ForwardNN.Trainer.BFGS, ForwardNN.Trainer.L_BFGS_B):
+        if method == ForwardNN.Trainer.BFGS and initial.size > max_bfgs_params:
+            results[method] = {'skipped': "%d weights, dense Hessian of %.1f MiB" %
+                                          (initial.size, 8.0 * initial.size ** 2 / 2 ** 20)}
+            continue
+        NN = ForwardNN.ForwardNN(layers)
+        NN.set_params(initial)
+        trainer = ForwardNN.Trainer(NN, method=method, maxiter=maxiter, history=history)
+        elapsed, peak = _measure(lambda: trainer.train(x, y), 1, warmup=False)
+        results[method] = {'seconds': elapsed, 'peak_bytes': peak, 'cost': NN.cost_function(x, y),
+                           'iterations': trainer.iterations, 'evaluations': trainer.evaluations,
+                           'converged': trainer.converged}
+    return results
+
+
+def precision(layers, x, y, iterations, maxiter, seed=0):
+    """Compares float64 and float32 networks started from the same weights
+
+    Training uses L-BFGS-B, whose float64 master copy makes the float32 run mixed precision.
+
+    Returns:
+        dict: Seconds per value_and_grad and per predict, weight bytes and final L-BFGS-B cost for each dtype
+    """
+    np.random.seed(seed)
+    initial = ForwardNN.ForwardNN(layers).get_params().copy()
+
+    results = {}
+    for dtype in (np.float64, np.float32):
+        NN = ForwardNN.ForwardNN(layers, dtype=dtype)
+        NN.set_params(initial)
+        xd, yd = NN.cast(x), NN.cast(y)
+        params = NN.get_params().copy()
+
+        NN.allocate_workspace(x.shape[0])
+        gradient, _ = _measure(lambda: NN.value_and_grad(params, xd, yd), iterations)
+        NN.release_workspace()
+        predict, _ = _measure(lambda: NN.predict(xd), iterations)
+
+        trainer = ForwardNN.Trainer(NN, method=ForwardNN.Trainer.L_BFGS_B, maxiter=maxiter)
+        training, _ = _measure(lambda: trainer.train(x, y), 1, warmup=False)
+        results[np.dtype(dtype).name] = {'gradient_seconds': gradient, 'predict_seconds': predict,
+                                         'train_seconds': training, 'weight_bytes': NN.params.nbytes,
+                                         'cost': float(NN.cost_function(x, y))}
+    return results
+
+
+def _print_precision(results):
+    for name in sorted(results):
+        result = results[name]
+        print("%-8s %8.3f ms/gradient   %8.3f ms/predict   %7.2f s training   %8.1f KiB weights   cost %.5f" %
+              (name, result['gradient_seconds'] * 1000, result['predict_seconds'] * 1000,
+               result['train_seconds'], result['weight_bytes'] / 1024.0, result['cost']))
+
+
+# Network settings compared by the convergence benchmark
+CONVERGENCE_CONFIGS = [
+    ('normal, no bias', {}),
+    ('xavier + bias', {'bias': True, 'init': ForwardNN.ForwardNN.XAVIER_INIT}),
+    ('he + bias, relu/softmax-CE', {'bias': True, 'init': ForwardNN.ForwardNN.HE_INIT,
+                                    'activation': 'relu', 'loss': 'softmax_cross_entropy'}),
+]
+
+
+def convergence(hidden, x, y, restarts, maxiter, target, method=ForwardNN.Trainer.BFGS):
+    """Trains seeded restarts of each network setting and measures how often they reach the target cost
+
+    The target is compared with the sum of squares of the outputs, which all settings share.
+
+    Returns:
+        dict: For each setting, the fraction of restarts reaching the target, the mean iterations and
+                evaluations per restart, and the mean final sum of squares
+    """
+    layers = (x.shape[1],) + tuple(hidden) + (y.shape[1],)
+    sse = activations.get_loss("sse")
+
+    results = {}
+    for name, config in CONVERGENCE_CONFIGS:
+        config = dict(config)
+        if 'activation' in config:
+            config['activation'] = [config['activation']] * len(hidden) + ['softmax']
+        reached = iterations = evaluations = cost = 0
+        for seed in range(restarts):
+            NN = ForwardNN.ForwardNN(layers, seed=seed, **config)
+            trainer = ForwardNN.Trainer(NN, method=method, maxiter=maxiter)
+            trainer.train(x, y)
+            final = sse.value(y, NN.predict(x))
+            reached += final <= target
+            iterations += trainer.iterations
+            evaluations += trainer.evaluations
+            cost += final
+        results[name] = {'reached': float(reached) / restarts, 'iterations': float(iterations) / restarts,
+                         'evaluations': float(evaluations) / restarts, 'sse': cost / restarts}
+    return results
+
+
+def _print_convergence(results):
+    for name, _ in CONVERGENCE_CONFIGS:
+        result = results[name]
+        print("%-28s reached target %5.1f%%   %6.1f iterations   %6.1f evaluations   mean SSE %.4f" %
+              (name, result['reached'] * 100, result['iterations'], result['evaluations'], result['sse']))
+
+
+def _latencies(func, iterations, warmup=True):
+    """Times every call of func separately
+
+    Returns:
+        ndarray: Seconds of each call
+    """
+    if warmup:
+        func()
+    seconds = np.empty(iterations)
+    for i in range(iterations):
+        start = time.time()
+        func()
+        seconds[i] = time.time() - start
+    return seconds
+
+
+def _peak_memory(func):
+    """Runs func once under tracemalloc, apart from the timed calls whose speed tracing would distort
+
+    Returns:
+        int: Peak traced bytes, None without tracemalloc
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _summarize(seconds, rows, peak):
+    """Latency percentiles, throughput and peak memory of the timed calls of one case
+
+    Returns:
+        dict: mean/p50/p90/p99 seconds per call, rows per second at the mean latency and peak bytes
+    """
+    mean = float(np.mean(seconds))
+    result = {'mean': mean, 'rows_per_second': rows / mean if mean > 0 else None, 'peak_bytes': peak,
+              'calls': int(seconds.size)}
+    for percentile in (50, 90, 99):
+        result['p%d' % percentile] = float(np.percentile(seconds, percentile))
+    return result
+
+
+def _case(func, iterations, rows):
+    return _summarize(_latencies(func, iterations), rows, _peak_memory(func))
+
+
+def _network_cases(layers, batch, iterations):
+    """Cases of the network hot paths for one layer configuration and batch size
+
+    Returns:
+        dict: Summary of each hot path
+    """
+    x, y = synthetic_data(batch, layers[0], layers[-1])
+    NN = ForwardNN.ForwardNN(layers, seed=0)
+    params = NN.get_params().copy()
+
+    results = {
+        'forward': _case(lambda: NN.forward(x), iterations, batch),
+        'cost_function_prime': _case(lambda: NN.cost_function_prime(x, y), iterations, batch),
+        'predict': _case(lambda: NN.predict(x), iterations, batch),
+    }
+    NN.allocate_workspace(batch)
+    results['value_and_grad'] = _case(lambda: NN.value_and_grad(params, x, y), iterations, batch)
+    NN.release_workspace()
+
+    def round_trip():
+        NN.set_params(NN.get_params().copy())
+    results['get_set_params'] = _case(round_trip, iterations, batch)
+    return results
+
+
+def suite(widths, depths, batches, iterations, maxiter, seed=0):
+    """Sweeps the hot paths over layer widths, depths and batch sizes, plus training and I/O on PatternCell
+
+    Every network of the sweep has 35 inputs and 10 outputs like PatternCell; the PatternCell network
+    itself (35, 20, 10) is always included.
+
+    Params:
+        list: Widths of the hidden layers
+        list: # of hidden layers
+        list: # of data points per call
+        int: Timed calls of every case
+        int: Maximum L-BFGS-B iterations of the training cases
+        int: Seed of the training weights
+
+    Returns:
+        dict: Summary of every case, keyed by "<hot path>/<layers>/b<batch>"; the checkpoint cases are keyed
+                by "w<# of weights>" and their rows_per_second counts weights
+    """
+    configurations = [(35, 20, 10)]
+    for depth in depths:
+        for width in widths:
+            layers = (35,) + (width,) * depth + (10,)
+            if layers not in configurations:
+                configurations.append(layers)
+
+    results = {}
+    for layers in configurations:
+        for batch in batches:
+            name = "-".join(str(size) for size in layers)
+            for path, result in _network_cases(layers, batch, iterations).items():
+                results["%s/%s/b%d" % (path, name, batch)] = result
+
+    # Training on the PatternCell data, with the same initial weights on every call
+    X, Y = patterncell_data()
+    initial = ForwardNN.ForwardNN((35, 20, 10), seed=seed).get_params().copy()
+    for method in (ForwardNN.Trainer.BFGS, ForwardNN.Trainer.L_BFGS_B):
+        NN = ForwardNN.ForwardNN((35, 20, 10))
+        trainer = ForwardNN.Trainer(NN, method=method, maxiter=maxiter)
+
+        def train():
+            NN.set_params(initial)
+            trainer.train(X, Y)
+        results["train_%s/35-20-10/b%d" % (method, X.shape[0])] = _case(train, max(1, iterations // 10), X.shape[0])
+
+    # Reading the data as script.readFile does, and saving and loading weights as script.save does
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Problems", "PatternCell", "Inputs")
+    results["read_matrix/PatternCell/b%d" % X.shape[0]] = _case(lambda: dataset.read_matrix(base), iterations,
+                                                                X.shape[0])
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "weights")
+        NN = ForwardNN.ForwardNN((35, 100, 100, 10), seed=seed)
+        rows = NN.params.size
+        results["checkpoint_save/35-100-100-10/w%d" % rows] = _case(lambda: checkpoint.save(NN, filename),
+                                                                    iterations, rows)
+        results["checkpoint_load/35-100-100-10/w%d" % rows] = _case(
+            lambda: checkpoint.load(filename, mmap=False, verify=True), iterations, rows)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def save_results(results, filename):
+    """Writes suite results as JSON, along with the environment they were measured in"""
+    document = {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'machine': platform.machine()},
+        'results': results,
+    }
+    with open(filename, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold, metric='p50'):
+    """Compares suite results with a baseline saved by save_results
+
+    Params:
+        dict: Results of suite
+        str: Name of the baseline JSON file
+        float: Allowed relative slowdown, e.g. 0.1 for 10%
+        str: Latency compared, 'mean', 'p50', 'p90' or 'p99'
+
+    Returns:
+        list: (case, baseline seconds, seconds, relative change) of every case slower than allowed
+        list: (case, baseline seconds, seconds, relative change) of every case found in both
+    """
+    with open(baseline, 'r') as f:
+        reference = json.load(f)['results']
+
+    changes = []
+    regressions = []
+    for name in sorted(results):
+        if name not in reference:
+            continue
+        before = reference[name][metric]
+        after = results[name][metric]
+        change = (after - before) / before if before > 0 else 0.0
+        changes.append((name, before, after, change))
+        if change > threshold:
+            regressions.append((name, before, after, change))
+    return regressions, changes
+
+
+def _print_suite(results):
+    for name in sorted(results):
+        result = results[name]
+        peak = result['peak_bytes']
+        print("%-44s p50 %9.3f ms   p99 %9.3f ms   %12.0f rows/s   peak %s" %
+              (name, result['p50'] * 1000, result['p99'] * 1000, result['rows_per_second'] or 0,
+               "n/a" if peak is None else "%.1f KiB" % (peak / 1024.0)))
+
+
+def _print_comparison(changes, threshold):
+    for name, before, after, change in changes:
+        print("%-44s %9.3f ms -> %9.3f ms   %+7.1f%%%s" % (name, before * 1000, after * 1000, change * 100,
+                                                          "   REGRESSION" if change > threshold else ""))
+
+
+def data_parallel(layers, rows, iterations, workers):
+    """Times full-data cost and gradient evaluations in one process and sharded over worker processes
+
+    Returns:
+        dict: Seconds per evaluation for 1 (in process) and for every # of workers
+    """
+    x, y = synthetic_data(rows, layers[0], layers[-1])
+    NN = ForwardNN.ForwardNN(layers, seed=0)
+    params = NN.get_params().copy()
+
+    NN.allocate_workspace(rows)
+    results = {1: float(np.mean(_latencies(lambda: NN.value_and_grad(params, x, y), iterations)))}
+    NN.release_workspace()
+    for count in workers:
+        if count > 1:
+            with parallel.ShardedEvaluator(NN, x, y, count) as evaluator:
+                results[count] = float(np.mean(_latencies(lambda: evaluator.value_and_grad(params), iterations)))
+    return results
+
+
+def _print_data_parallel(results):
+    for count in sorted(results):
+        print("%3d workers %10.3f ms/eval   speedup %5.2fx" % (count, results[count] * 1000,
+                                                              results[1] / results[count]))
+
+
+def ensemble_inference(layers, batches, members, iterations):
+    """Times forwarding K networks one by one with predict and together as an ensemble.Ensemble
+
+    Returns:
+        dict: {(members, batch): {'loop': seconds, 'ensemble': seconds}} per forward of every network
+    """
+    results = {}
+    for count in members:
+        networks = [ForwardNN.ForwardNN(layers, seed=i) for i in range(count)]
+        models = ensemble.Ensemble(networks)
+        for batch in batches:
+            x, _ = synthetic_data(batch, layers[0], layers[-1])
+            results[(count, batch)] = {
+                'loop': float(np.median(_latencies(lambda: [NN.predict(x) for NN in networks], iterations))),
+                'ensemble': float(np.median(_latencies(lambda: models.outputs(x), iterations))),
+            }
+    return results
+
+
+def _print_ensemble(results):
+    for count, batch in sorted(results):
+        result = results[(count, batch)]
+        print("%3d networks  batch %6d   loop %10.3f ms   ensemble %10.3f ms   speedup %5.2fx" %
+              (count, batch, result['loop'] * 1000, result['ensemble'] * 1000, result['loop'] / result['ensemble']))
+
+
+def _print_full_batch(name, results):
+    print(name)
+    for method in sorted(results):
+        result = results[method]
+        if 'skipped' in result:
+            print("  %-9s skipped (%s)" % (method, result['skipped']))
+            continue
+        peak = result['peak_bytes']
+        print("  %-9s %8.2f s   peak %s   cost %.5f   %d iterations   %d evaluations   converged %s" %
+              (method, result['seconds'], "n/a" if peak is None else "%.1f MiB" % (peak / 2.0 ** 20),
+               result['cost'], result['iterations'], result['evaluations'], result['converged']))
+
+
+def _print_results(results):
+    for mode in sorted(results):
+        peak = results[mode]['peak_bytes']
+        print("%-12s %10.3f ms/eval   peak %s" % (mode, results[mode]['seconds'] * 1000,
+                                                 "n/a" if peak is None else "%.1f KiB" % (peak / 1024.0)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks ForwardNN hot paths")
+    parser.add_argument("benchmark", choices=["allocation", "full-batch", "precision", "convergence", "suite",
+                                              "data-parallel", "ensemble"],
+                        help="Benchmark to run")
+    parser.add_argument("--layers", type=int, nargs='+', default=[35, 100, 100, 10],
+                        help="Layer sizes of the synthetic network, input first and output last")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of synthetic data points")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed repetitions")
+    parser.add_argument("--hidden", type=int, nargs='*', default=[20],
+                        help="Hidden layer sizes of the PatternCell network (full-batch)")
+    parser.add_argument("--maxiter", type=int, default=200, help="Maximum optimizer iterations (full-batch)")
+    parser.add_argument("--history", type=int, default=10, help="L-BFGS-B history size (full-batch)")
+    parser.add_argument("--restarts", type=int, default=10, help="Seeded restarts per setting (convergence)")
+    parser.add_argument("--target", type=float, default=0.1,
+                        help="Sum of squares counted as converged (convergence)")
+    parser.add_argument("--max-bfgs-params", type=int, default=5000,
+                        help="Skips BFGS on networks with more weights than this (full-batch)")
+    parser.add_argument("--widths", type=int, nargs='+', default=[20, 100, 300],
+                        help="Hidden layer widths swept (suite)")
+    parser.add_argument("--depths", type=int, nargs='+', default=[1, 2], help="# of hidden layers swept (suite)")
+    parser.add_argument("--batches", type=int, nargs='+', default=[1, 32, 1024],
+                        help="Data points per call swept (suite)")
+    parser.add_argument("--output", default=None, help="Saves the results as JSON (suite)")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON results to compare with; exits with status 1 on a regression (suite)")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative p50 slowdown counted as a regression (suite)")
+    parser.add_argument("--members", type=int, nargs='+', default=[4, 16],
+                        help="# of networks of each ensemble timed (ensemble)")
+    parser.add_argument("--workers", type=int, nargs='+', default=[2, 4, 8],
+                        help="# of worker processes compared with one process (data-parallel)")
+    args = parser.parse_args()
+
+    if args.benchmark == "allocation":
+        _print_results(allocation(tuple(args.layers), args.rows, args.iterations))
+    elif args.benchmark == "full-batch":
+        X, Y = patterncell_data()
+        layers = (X.shape[1],) + tuple(args.hidden) + (Y.shape[1],)
+        _print_full_batch("PatternCell " + str(layers),
+                          full_batch(layers, X, Y, args.maxiter, args.history, args.max_bfgs_params))
+        X, Y = synthetic_data(args.rows, args.layers[0], args.layers[-1])
+        _print_full_batch("Synthetic " + str(tuple(args.layers)),
+                          full_batch(tuple(args.layers), X, Y, args.maxiter, args.history, args.max_bfgs_params))
+    elif args.benchmark == "precision":
+        X, Y = synthetic_data(args.rows, args.layers[0], args.layers[-1])
+        _print_precision(precision(tuple(args.layers), X, Y, args.iterations, args.maxiter))
+    elif args.benchmark == "convergence":
+        X, Y = patterncell_data()
+        _print_convergence(convergence(args.hidden, X, Y, args.restarts, args.maxiter, args.target))
+    elif args.benchmark == "suite":
+        results = suite(args.widths, args.depths, args.batches, args.iterations, args.maxiter)
+        _print_suite(results)
+        if args.output is not None:
+            save_results(results, args.output)
+        if args.baseline is not None:
+            regressions, changes = compare(results, args.baseline, args.threshold)
+            print()
+            _print_comparison(changes, args.threshold)
+            if regressions:
+                print("%d of %d cases regressed by more than %.0f%%" %
+                      (len(regressions), len(changes), args.threshold * 100))
+                sys.exit(1)
+    elif args.benchmark == "data-parallel":
+        _print_data_parallel(data_parallel(tuple(args.layers), args.rows, args.iterations, args.workers))
+    elif args.benchmark == "ensemble":
+        _print_ensemble(ensemble_inference(tuple(args.layers), args.batches, args.members, args.iterations))
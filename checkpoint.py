@@ -0,0 +1,164 @@
+"""Versioned binary checkpoints of ForwardNN weights.
+
+A checkpoint file is laid out as:
+
+    MAGIC (8 bytes) | header length (uint32, little endian) | JSON header | padding | parameters
+
+The JSON header records the format version, the layer sizes, the activations, loss and biases, the
+dtype and size of the parameters, their CRC-32 checksum and the offset of the parameters, which is
+aligned to ALIGNMENT bytes. The parameters are the raw bytes of ForwardNN.params, so loading can map
+them with np.memmap: nothing is read until used, and every process mapping the same file shares one
+copy in the page cache.
+"""
+import json
+import os
+import struct
+import uuid
+import zlib
+
+import numpy as np
+
+import ForwardNN
+
+__author__ = 'John Bucknam & Bill Clark'
+
+MAGIC = b'FWDNNCKP'
+VERSION = 3
+ALIGNMENT = 64
+
+_LENGTH = struct.Struct('<I')
+
+
+class CheckpointError(ValueError):
+    """Raised when a file is not a valid checkpoint"""
+
+
+def is_checkpoint(filename):
+    """Returns whether the file starts with the checkpoint magic bytes
+
+    Returns:
+        bool: True if the file is a binary checkpoint
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _checksum(params):
+    """CRC-32 of the raw bytes of the parameters, read in chunks of at most 64 MiB"""
+    flat = np.ascontiguousarray(params).ravel()
+    step = max(1, (64 << 20) // max(1, flat.itemsize))
+    crc = 0
+    for start in range(0, flat.size, step):
+        crc = zlib.crc32(flat[start:start + step].tobytes(), crc)
+    return crc & 0xffffffff
+
+
+def save(NN, filename):
+    """Writes the weights and layer sizes of a ForwardNN as a binary checkpoint
+
+    Params:
+        ForwardNN: Network to save
+        str: Name of the checkpoint file
+    """
+    params = np.ascontiguousarray(NN.get_params())
+    config = NN.get_config()
+    header = {
+        'version': VERSION,
+        'layer_sizes': [int(size) for size in NN.layerSizes],
+        'activations': config['activation'],
+        'loss': config['loss'],
+        'bias': config['bias'],
+        'dtype': params.dtype.str,
+        'count': int(params.size),
+        'crc32': _checksum(params),
+    }
+
+    # The offset depends on the header length, which depends on the offset; a fixed width settles it
+    header['offset'] = 0
+    prefix = len(MAGIC) + _LENGTH.size
+    length = len(json.dumps(header, sort_keys=True)) + 20
+    header['offset'] = (prefix + length + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    encoded = json.dumps(header, sort_keys=True).encode('ascii').ljust(length)
+
+    # Writes a temporary file renamed over the checkpoint once complete: the network may be mapping its
+    # weights from the file being replaced, and a failed save leaves the previous checkpoint intact. It is
+    # opened like the checkpoint itself, so it gets the same permissions.
+    temporary = filename + "." + uuid.uuid4().hex + ".tmp"
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+            f.write(b'\0' * (header['offset'] - prefix - len(encoded)))
+            params.tofile(f)
+        os.rename(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def read_header(filename):
+    """Reads the header of a checkpoint
+
+    Returns:
+        dict: version, layer_sizes, activations, loss, bias, dtype, count, crc32 and offset of the checkpoint
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CheckpointError(filename + " is not a ForwardNN checkpoint")
+        length = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+        header = json.loads(f.read(length).decode('ascii'))
+    if header['version'] > VERSION:
+        raise CheckpointError(filename + " has checkpoint version " + str(header['version']) +
+                              ", only versions up to " + str(VERSION) + " are supported")
+
+    # Version 1 checkpoints predate configurable activations and losses, versions 1 and 2 predate biases
+    header.setdefault('activations', None)
+    header.setdefault('loss', None)
+    header.setdefault('bias', False)
+    return header
+
+
+def load(filename, mmap=True, mode='c', verify=False):
+    """Loads a ForwardNN from a checkpoint
+
+    Params:
+        str: Name of the checkpoint file
+        bool: Maps the parameters with np.memmap instead of reading them into memory
+        str: np.memmap mode; 'c' is copy-on-write (pages are shared until the network writes to them,
+                e.g. when trained, and the file is never modified), 'r' is read-only (the network can only
+                be used for inference)
+        bool: Checks the CRC-32 of the parameters, which reads the whole file
+
+    Returns:
+        ForwardNN: Network using the checkpoint's parameters as its weight buffer
+    """
+    header = read_header(filename)
+    dtype = np.dtype(header['dtype'])
+    if mmap:
+        params = np.memmap(filename, dtype=dtype, mode=mode, offset=header['offset'], shape=(header['count'],))
+    else:
+        with open(filename, 'rb') as f:
+            f.seek(header['offset'])
+            params = np.fromfile(f, dtype=dtype, count=header['count'])
+        if params.size != header['count']:
+            raise CheckpointError(filename + " is truncated")
+
+    if verify and _checksum(params) != header['crc32']:
+        raise CheckpointError(filename + " failed its checksum")
+
+    return ForwardNN.ForwardNN(tuple(header['layer_sizes']), params=params, dtype=dtype,
+                               activation=header['activations'], loss=header['loss'], bias=header['bias'])
+
+
+def verify(filename):
+    """Returns whether the parameters of a checkpoint match their checksum
+
+    Returns:
+        bool: True if the checksum matches
+    """
+    header = read_header(filename)
+    params = np.memmap(filename, dtype=np.dtype(header['dtype']), mode='r', offset=header['offset'],
+                       shape=(header['count'],))
+    return _checksum(params) == header['crc32']
@@ -0,0 +1,234 @@
+"""Loading of the space separated Inputs/Outputs data files.
+
+Each line of a data file is one data point, its values separated by spaces. Lines are parsed in
+vectorized chunks rather than token by token, a parsed file can be cached to a .npy sidecar that
+later loads are memory-mapped from, and iter_batches walks files too large to fit in memory.
+read_bits and read_sparse build the compact inputs of the inputs module chunk by chunk, so the dense
+matrix is never held whole.
+"""
+import itertools
+import os
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+import inputs
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Number of lines parsed at once
+CHUNK_ROWS = 65536
+
+
+def _parse(lines, dtype, columns):
+    """Parses a list of (line number, line) with the same number of values into a 2-D array
+
+    Params:
+        list: (int, str); Numbered lines of the file
+        dtype: Type of the parsed values
+        int: # of values every line must have
+
+    Returns:
+        ndarray: [len(lines), columns]
+    """
+    # The values are parsed all at once, so every line is counted first to keep them in their own row
+    for number, line in lines:
+        if len(line.split()) != columns:
+            raise ValueError("Line " + str(number) + " has " + str(len(line.split())) + " values instead of " +
+                             str(columns))
+    values = np.fromstring(" ".join(line for _, line in lines), dtype=dtype, sep=" ")
+    if values.size != columns * len(lines):
+        raise ValueError("Lines " + str(lines[0][0]) + " to " + str(lines[-1][0]) + " hold values that are not numbers")
+    return values.reshape(len(lines), columns)
+
+
+def iter_chunks(source, chunk_rows=CHUNK_ROWS, dtype=float):
+    """Parses a data file chunk by chunk
+
+    Params:
+        str or file: Name or open file of the data
+        int: Number of lines in each chunk
+        dtype: Type of the parsed values
+
+    Returns:
+        generator: ndarray; [chunk_rows, # of values per line] for every chunk, the last may be shorter
+    """
+    if isinstance(source, str):
+        with open(source, 'r') as f:
+            for chunk in iter_chunks(f, chunk_rows, dtype):
+                yield chunk
+        return
+
+    lines = ((number, line) for number, line in enumerate(source, 1) if line.strip())
+    columns = None
+    while True:
+        chunk = list(itertools.islice(lines, chunk_rows))
+        if not chunk:
+            return
+        if columns is None:
+            columns = len(chunk[0][1].split())
+        yield _parse(chunk, dtype, columns)
+
+
+def _count_rows(filename):
+    """Counts the non-empty lines of a file without parsing them
+
+    Returns:
+        int: Number of data points in the file
+        int: Number of values of the first data point
+    """
+    rows = 0
+    columns = None
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                if columns is None:
+                    columns = len(line.split())
+                rows += 1
+    return rows, columns
+
+
+def _fill(filename, out, chunk_rows, dtype):
+    """Parses a file chunk by chunk into a preallocated array"""
+    start = 0
+    for chunk in iter_chunks(filename, chunk_rows, dtype):
+        out[start:start + chunk.shape[0]] = chunk
+        start += chunk.shape[0]
+
+
+def read_matrix(source, dtype=float, chunk_rows=CHUNK_ROWS):
+    """Reads a whole data file into a 2-D array
+
+    A file name is counted first so the array is allocated once and filled chunk by chunk;
+    an open file is parsed in chunks that are then concatenated.
+
+    Params:
+        str or file: Name or open file of the data
+        dtype: Type of the parsed values
+        int: Number of lines parsed at once
+
+    Returns:
+        ndarray: [# of data points, # of values per data point]
+    """
+    if not isinstance(source, str):
+        chunks = list(iter_chunks(source, chunk_rows, dtype))
+        if not chunks:
+            return np.empty((0, 0), dtype=dtype)
+        return np.concatenate(chunks)
+
+    rows, columns = _count_rows(source)
+    out = np.empty((rows, columns or 0), dtype=dtype)
+    _fill(source, out, chunk_rows, dtype)
+    return out
+
+
+def read_bits(source, chunk_rows=CHUNK_ROWS):
+    """Reads a data file of 0 and 1 values into packed rows, 1 bit per value
+
+    Params:
+        str or file: Name or open file of the data
+        int: Number of lines parsed at once
+
+    Returns:
+        PackedBits: [# of data points, # of values per data point]
+    """
+    chunks = [inputs.PackedBits.pack(chunk) for chunk in iter_chunks(source, chunk_rows)]
+    if not chunks:
+        return inputs.PackedBits(np.empty((0, 0), dtype=np.uint8), 0)
+    return inputs.PackedBits(np.concatenate([chunk.packed for chunk in chunks]), chunks[0].columns)
+
+
+def read_sparse(source, dtype=float, chunk_rows=CHUNK_ROWS):
+    """Reads a data file into a sparse matrix, keeping only its non-zero values
+
+    Params:
+        str or file: Name or open file of the data
+        dtype: Type of the parsed values
+        int: Number of lines parsed at once
+
+    Returns:
+        csr_matrix: [# of data points, # of values per data point]
+    """
+    chunks = [sparse.csr_matrix(chunk) for chunk in iter_chunks(source, chunk_rows, dtype)]
+    if not chunks:
+        return sparse.csr_matrix((0, 0), dtype=dtype)
+    return sparse.vstack(chunks, format='csr')
+
+
+def cache_name(filename):
+    """Returns the name of the .npy sidecar caching a data file"""
+    return filename + ".npy"
+
+
+def load(filename, dtype=float, cache=True, mmap=True, chunk_rows=CHUNK_ROWS):
+    """Reads a data file, going through its .npy sidecar cache
+
+    The sidecar is rebuilt whenever the data file is newer than it or was cached with another dtype.
+
+    Params:
+        str: Name of the data file
+        dtype: Type of the parsed values
+        bool: Reads and writes the .npy sidecar; False always parses the text
+        bool: Memory-maps the cached array (read-only) instead of reading it into memory
+        int: Number of lines parsed at once
+
+    Returns:
+        ndarray: [# of data points, # of values per data point]
+    """
+    if not cache:
+        return read_matrix(filename, dtype, chunk_rows)
+
+    sidecar = cache_name(filename)
+    mmap_mode = 'r' if mmap else None
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(filename):
+        cached = np.load(sidecar, mmap_mode=mmap_mode)
+        if cached.dtype == np.dtype(dtype):
+            return cached
+
+    # Parses straight into a memory-mapped temporary file, so only one chunk is held in memory at a time,
+    # then renames it over the sidecar: a failed parse leaves no sidecar and readers never map half of one
+    rows, columns = _count_rows(filename)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(sidecar)), suffix=".tmp")
+    os.close(handle)
+    try:
+        out = np.lib.format.open_memmap(temporary, mode='w+', dtype=dtype, shape=(rows, columns or 0))
+        try:
+            _fill(filename, out, chunk_rows, dtype)
+            out.flush()
+        finally:
+            del out
+        os.rename(temporary, sidecar)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return np.load(sidecar, mmap_mode=mmap_mode)
+
+
+def iter_batches(input_source, output_source, batch_size, dtype=float):
+    """Walks matching Inputs and Outputs files in fixed-size batches without loading them whole
+
+    Params:
+        str or file: Inputs file
+        str or file: Outputs file, or None to walk only the inputs
+        int: Number of data points in each batch
+        dtype: Type of the parsed values
+
+    Returns:
+        generator: (ndarray, ndarray) input and output batches, or input batches alone when
+                    output_source is None; the last batch may be shorter
+    """
+    inputs = iter_chunks(input_source, batch_size, dtype)
+    if output_source is None:
+        for x in inputs:
+            yield x
+        return
+
+    outputs = iter_chunks(output_source, batch_size, dtype)
+    for x in inputs:
+        y = next(outputs, None)
+        if y is None or y.shape[0] != x.shape[0]:
+            raise ValueError("Need equal number of Inputs and Outputs")
+        yield x, y
+    if next(outputs, None) is not None:
+        raise ValueError("Need equal number of Inputs and Outputs")
@@ -0,0 +1,230 @@
+"""Ensembles of ForwardNN networks evaluated together.
+
+An Ensemble stacks the weights of K networks of the same layers and activations, so each layer of
+every network is computed by one matrix product instead of K. The first layer reads the inputs
+shared by all networks: its weights are laid side by side into one [inputs, K * nodes] matrix, so
+the inputs go through a single product (dense, sparse or packed, see the inputs module). Deeper
+layers hold [K, nodes, nodes] stacks multiplied by one batched np.matmul.
+
+The outputs of the networks are averaged (Ensemble.MEAN) or each network votes for its largest
+output (Ensemble.VOTE). restarts.train_ensemble keeps the best networks of Monte Carlo restarts as
+an Ensemble.
+"""
+import numpy as np
+
+import ForwardNN
+import inputs
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Bytes of the activations of all networks for one chunk of rows. Every network does the same
+# arithmetic as alone, so large inputs are bound by memory traffic; chunks that stay in cache keep the
+# batched products ahead of a loop over the networks.
+CHUNK_BYTES = 1 << 20
+
+
+class Ensemble(object):
+    """K networks of the same topology whose weights are stacked for batched evaluation"""
+
+    # CONSTANTS
+    MEAN = "mean"
+    VOTE = "vote"
+
+    def __init__(self, networks, combine=MEAN):
+        """Constructor
+
+        Params:
+            list: ForwardNN; Networks with the same layer sizes, activations, biases and dtype. Their
+                    weights are copied, so later changes to them need set_params.
+            str: Ensemble.MEAN averages the outputs, Ensemble.VOTE gives the fraction of networks whose
+                    largest output is each node
+        """
+        if not networks:
+            raise ValueError("An ensemble needs at least one network")
+        if combine not in (self.MEAN, self.VOTE):
+            raise ValueError("Unknown combination " + str(combine) + "; choose from " +
+                             ", ".join((self.MEAN, self.VOTE)))
+        first = networks[0]
+        for NN in networks[1:]:
+            if (NN.layerSizes != first.layerSizes or NN.hasBias != first.hasBias or NN.dtype != first.dtype or
+                    [a.name for a in NN.activation] != [a.name for a in first.activation]):
+                raise ValueError("Every network of an ensemble needs the same layers, activations, biases and dtype")
+
+        self.size = len(networks)
+        self.combine = combine
+        self.layerSizes = first.layerSizes
+        self.dtype = first.dtype
+        self.activation = first.activation
+        self.hasBias = first.hasBias
+        self._config = first.get_config()
+
+        # weight[0] is [inputs, K * nodes] with the weights of network k in columns k * nodes onward, every
+        # other weight[i] is [K, nodes, nodes]. Biases match: [K * nodes] first, then [K, 1, nodes].
+        sizes = self.layerSizes
+        self.weight = [np.empty((sizes[0], self.size * sizes[1]), dtype=self.dtype)]
+        self.weight += [np.empty((self.size, sizes[i], sizes[i + 1]), dtype=self.dtype)
+                        for i in range(1, len(sizes) - 1)]
+        self.bias = None
+        if self.hasBias:
+            self.bias = [np.empty(self.size * sizes[1], dtype=self.dtype)]
+            self.bias += [np.empty((self.size, 1, sizes[i + 1]), dtype=self.dtype) for i in range(1, len(sizes) - 1)]
+        for index, NN in enumerate(networks):
+            self._stack(index, NN)
+
+    @classmethod
+    def from_params(cls, layer_sizes, params, network_kwargs=None, combine=MEAN):
+        """Builds an ensemble from the flat weights of each network
+
+        Params:
+            tuple: Layer sizes of the networks
+            list: ndarray; 1-D weights of each network, laid out as in ForwardNN.get_params
+            dict: Keyword arguments of every ForwardNN, e.g. activation and dtype
+            str: Combination of the outputs, Ensemble.MEAN or Ensemble.VOTE
+
+        Returns:
+            Ensemble
+        """
+        network_kwargs = network_kwargs or {}
+        dtype = network_kwargs.get('dtype', np.float64)
+        networks = [ForwardNN.ForwardNN(layer_sizes, params=np.array(p, dtype=dtype), **network_kwargs)
+                    for p in params]
+        return cls(networks, combine)
+
+    def _columns(self, index):
+        """Returns the columns of the first layer holding network index"""
+        nodes = self.layerSizes[1]
+        return slice(index * nodes, (index + 1) * nodes)
+
+    def _stack(self, index, NN):
+        """Copies the weights of a network into slot index of the stacks"""
+        columns = self._columns(index)
+        self.weight[0][:, columns] = NN.weight[0]
+        for i in range(1, len(self.weight)):
+            self.weight[i][index] = NN.weight[i]
+        if self.hasBias:
+            self.bias[0][columns] = NN.bias[0]
+            for i in range(1, len(self.bias)):
+                self.bias[i][index, 0] = NN.bias[i]
+
+    def network(self, index):
+        """Returns:
+            ForwardNN: New network with the weights of network index
+        """
+        NN = ForwardNN.ForwardNN(self.layerSizes, params=np.empty(self._param_count(), dtype=self.dtype),
+                                 **self._config)
+        columns = self._columns(index)
+        NN.weight[0][...] = self.weight[0][:, columns]
+        for i in range(1, len(self.weight)):
+            NN.weight[i][...] = self.weight[i][index]
+        if self.hasBias:
+            NN.bias[0][...] = self.bias[0][columns]
+            for i in range(1, len(self.bias)):
+                NN.bias[i][...] = self.bias[i][index, 0]
+        return NN
+
+    def _param_count(self):
+        sizes = self.layerSizes
+        return sum(sizes[i] * sizes[i + 1] + (sizes[i + 1] if self.hasBias else 0) for i in range(len(sizes) - 1))
+
+    def get_params(self, index):
+        """Returns:
+            ndarray: 1-D copy of the weights of network index, laid out as in ForwardNN.get_params
+        """
+        return self.network(index).get_params()
+
+    def set_params(self, index, params):
+        """Replaces the weights of network index, e.g. after training it further
+
+        Params:
+            int: Index of the network
+            ndarray: 1-D weights laid out as in ForwardNN.get_params
+        """
+        if np.size(params) != self._param_count():
+            raise ValueError("Need " + str(self._param_count()) + " weights for each network")
+        self._stack(index, ForwardNN.ForwardNN(self.layerSizes, params=np.array(np.ravel(params), dtype=self.dtype),
+                                               **self._config))
+
+    def outputs(self, input_matrix, batch_size=None):
+        """Feeds the input forward through every network
+
+        Params:
+            ndarray: Input; Should match [n, InputLayerSize]. May also be a scipy.sparse matrix or inputs.PackedBits
+            int: Forwards at most this many rows at a time; None picks chunks of about CHUNK_BYTES of activations
+
+        Returns:
+            ndarray: [K, n, OutputLayerSize] output of each network
+        """
+        # Sparse formats such as COO cannot be sliced, so compact inputs are converted once, to CSR
+        compact = inputs.is_compact(input_matrix)
+        if compact:
+            input_matrix = inputs.as_input(input_matrix, self.dtype)
+        rows = input_matrix.shape[0]
+        width = self.size * max(self.layerSizes[1:])
+        if batch_size is None:
+            batch_size = max(1, CHUNK_BYTES // (width * self.dtype.itemsize))
+        chunk = min(batch_size, rows) or 1
+        output = np.empty((self.size, rows, self.layerSizes[-1]), dtype=self.dtype)
+
+        # The first layer's product, then two flat buffers wide enough for any layer; each layer reads
+        # one and writes the other
+        first = np.empty(chunk * self.weight[0].shape[1], dtype=self.dtype)
+        buffers = [np.empty(chunk * width, dtype=self.dtype) for _ in range(2)]
+
+        for start in range(0, rows, chunk):
+            end = min(start + chunk, rows)
+            n = end - start
+            a = input_matrix[start:end]
+            if not compact:
+                a = np.asarray(a, dtype=self.dtype)
+
+            # [n, K * nodes] regrouped as [K, n, nodes]
+            z = ForwardNN.ForwardNN._dot(a, self.weight[0], first[:n * first.size // chunk].reshape(n, -1))
+            if self.hasBias:
+                z += self.bias[0]
+            nodes = self.layerSizes[1]
+            a = buffers[0][:self.size * n * nodes].reshape(self.size, n, nodes)
+            a[...] = z.reshape(n, self.size, nodes).transpose(1, 0, 2)
+            self._activate(0, a)
+
+            for i in range(1, len(self.weight)):
+                nodes = self.layerSizes[i + 1]
+                out = buffers[i % 2][:self.size * n * nodes].reshape(self.size, n, nodes)
+                z = np.matmul(a, self.weight[i], out=out)
+                if self.hasBias:
+                    z += self.bias[i]
+                a = self._activate(i, z)
+            output[:, start:end] = a
+        return output
+
+    def _activate(self, i, z):
+        """Applies the activation of layer i in place to [K, n, nodes] contiguous input sums
+
+        Softmax normalizes each row, so the stacks are seen as one [K * n, nodes] matrix.
+
+        Returns:
+            ndarray: z
+        """
+        rows = z.reshape(-1, z.shape[-1])
+        self.activation[i].forward(rows, rows)
+        return z
+
+    def predict(self, input_matrix, batch_size=None):
+        """Combines the outputs of the networks
+
+        Params:
+            ndarray: Input; Should match [n, InputLayerSize]. May also be a scipy.sparse matrix or inputs.PackedBits
+            int: Forwards at most this many rows at a time; None picks chunks as outputs does
+
+        Returns:
+            ndarray: [n, OutputLayerSize]; mean of the outputs, or with Ensemble.VOTE the fraction of the
+                        networks whose largest output is each node
+        """
+        outputs = self.outputs(input_matrix, batch_size)
+        if self.combine == self.MEAN:
+            return outputs.mean(axis=0)
+        votes = outputs.argmax(axis=2)
+        counts = np.zeros(outputs.shape[1:], dtype=self.dtype)
+        rows = np.arange(outputs.shape[1])
+        for choice in votes:
+            counts[rows, choice] += 1
+        return counts / self.size
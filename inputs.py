@@ -0,0 +1,157 @@
+"""Compact formats of binary and sparse inputs to a ForwardNN.
+
+Besides dense arrays, ForwardNN accepts as inputs:
+
+- scipy.sparse matrices (converted to CSR), for sparse and one-hot features. The first layer and its
+  gradient use sparse matrix products, so their cost follows the # of non-zero values.
+- PackedBits, binary rows packed 8 values per byte as by np.packbits, for grids such as PatternCell:
+  1 bit per value instead of the 64 of a float64.
+
+Only the first layer reads the inputs. Packed rows are unpacked a chunk at a time into a small buffer
+that feeds a regular matrix product, which keeps the speed of dense inputs; summing precomputed
+per-byte tables of weights instead was several times slower than the matrix product.
+"""
+import numpy as np
+from scipy import sparse
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Number of packed rows unpacked at once
+CHUNK_ROWS = 4096
+
+
+class PackedBits(object):
+    """Binary inputs packed 8 values per byte, each row as np.packbits packs it"""
+
+    ndim = 2
+
+    def __init__(self, packed, columns):
+        """Constructor
+
+        Params:
+            ndarray: uint8 array [n, ceil(columns / 8)] of packed rows
+            int: # of values of each row
+        """
+        packed = np.asarray(packed, dtype=np.uint8)
+        if packed.ndim != 2 or packed.shape[1] != (columns + 7) // 8:
+            raise ValueError("Packed rows of " + str(columns) + " values need " + str((columns + 7) // 8) +
+                             " bytes each")
+        self.packed = packed
+        self.columns = columns
+
+    @classmethod
+    def pack(cls, matrix):
+        """Packs a matrix of 0 and 1 values
+
+        Returns:
+            PackedBits: Packed rows of the matrix
+        """
+        matrix = np.atleast_2d(np.asarray(matrix))
+        if not np.all((matrix == 0) | (matrix == 1)):
+            raise ValueError("Only 0 and 1 values can be packed")
+        return cls(np.packbits(matrix.astype(np.uint8), axis=1), matrix.shape[1])
+
+    @property
+    def shape(self):
+        return (self.packed.shape[0], self.columns)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    def __getitem__(self, rows):
+        """Selects rows, by index, slice or array of indices
+
+        Returns:
+            PackedBits: Selected rows
+        """
+        return PackedBits(np.atleast_2d(self.packed[rows]), self.columns)
+
+    def unpack(self, dtype=np.float64, out=None):
+        """Returns:
+            ndarray: [n, columns] values as dtype, written into out when given
+        """
+        bits = np.unpackbits(self.packed, axis=1)[:, :self.columns]
+        if out is None:
+            return bits.astype(dtype)
+        np.copyto(out, bits)
+        return out
+
+
+def is_compact(matrix):
+    """Returns whether inputs are in a compact format rather than a dense array"""
+    return isinstance(matrix, PackedBits) or sparse.issparse(matrix)
+
+
+def as_input(matrix, dtype):
+    """Converts compact inputs for a network of dtype: sparse matrices to CSR of dtype, packed bits unchanged
+
+    Returns:
+        csr_matrix or PackedBits
+    """
+    if isinstance(matrix, PackedBits):
+        return matrix
+    matrix = matrix.tocsr()
+    if matrix.dtype != dtype:
+        matrix = matrix.astype(dtype)
+    return matrix
+
+
+def to_dense(matrix, dtype=np.float64):
+    """Returns:
+        ndarray: Inputs of any format as a dense array
+    """
+    if isinstance(matrix, PackedBits):
+        return matrix.unpack(dtype)
+    if sparse.issparse(matrix):
+        return matrix.toarray().astype(dtype, copy=False)
+    return np.asarray(matrix, dtype=dtype)
+
+
+def _chunks(matrix, dtype):
+    """Unpacks packed rows a chunk at a time into one reused buffer
+
+    Returns:
+        generator: (int, int, ndarray) first row, end row and unpacked values of every chunk
+    """
+    rows = matrix.shape[0]
+    buffer = np.empty((min(CHUNK_ROWS, rows), matrix.columns), dtype=dtype)
+    for start in range(0, rows, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, rows)
+        yield start, end, matrix[start:end].unpack(dtype, buffer[:end - start])
+
+
+def dot(matrix, weight, out=None):
+    """Product of compact inputs with the weights of the first layer
+
+    Returns:
+        ndarray: [n, weight.shape[1]]; out, or a new array when out is None
+    """
+    if out is None:
+        out = np.empty((matrix.shape[0], weight.shape[1]), dtype=weight.dtype)
+    if isinstance(matrix, PackedBits):
+        for start, end, values in _chunks(matrix, weight.dtype):
+            out[start:end] = np.dot(values, weight)
+    else:
+        out[...] = matrix.dot(weight)
+    return out
+
+
+def transpose_dot(matrix, delta, out=None):
+    """Product of the transposed compact inputs with the deltas of the first layer, its weight gradients
+
+    Returns:
+        ndarray: [columns, delta.shape[1]]; out, or a new array when out is None
+    """
+    if out is None:
+        out = np.empty((matrix.shape[1], delta.shape[1]), dtype=delta.dtype)
+    if isinstance(matrix, PackedBits):
+        out.fill(0)
+        for start, end, values in _chunks(matrix, delta.dtype):
+            out += np.dot(values.T, delta[start:end])
+    else:
+        out[...] = matrix.T.dot(delta)
+    return out
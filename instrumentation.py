@@ -0,0 +1,224 @@
+"""Timings and telemetry of ForwardNN training runs.
+
+An Instrumentation given to a Trainer (or set as ForwardNN.instrumentation) accumulates the time spent
+in each phase of an evaluation and records one entry per optimizer iteration:
+
+    {"event": "iteration", "iteration": 3, "evaluations": 5, "cost": 0.41, "grad_norm": 0.02,
+     "elapsed": 0.012, "seconds": 0.004, "phases": {"forward": 0.001, ...}}
+
+elapsed is the wall time since the start of training and seconds the wall time of the iteration,
+split in phases into forward, cost, backward, set_params, validation, shards (data-parallel
+evaluations, which are not split further) and optimizer (whatever time the optimizer spends outside
+of the network). Entries are written as JSON lines to a log and/or given to a callback; a final
+"summary" entry holds the totals. cProfile and tracemalloc capture are optional.
+"""
+from __future__ import print_function
+
+import contextlib
+import cProfile
+import json
+import pstats
+import timeit
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Phases of an evaluation timed by ForwardNN, and the time the optimizer spends between evaluations
+FORWARD = "forward"
+COST = "cost"
+BACKWARD = "backward"
+SET_PARAMS = "set_params"
+OPTIMIZER = "optimizer"
+VALIDATION = "validation"
+SHARDS = "shards"
+PHASES = (FORWARD, COST, BACKWARD, SET_PARAMS, OPTIMIZER, VALIDATION, SHARDS)
+
+_clock = timeit.default_timer
+
+
+class Instrumentation(object):
+    """Collects per-phase timers and per-iteration telemetry of a training run"""
+
+    def __init__(self, log=None, callback=None, profile=False, trace_memory=False):
+        """Constructor
+
+        Params:
+            str or file: JSONL log the entries are written to; a file name is opened (truncated) by start.
+                            None keeps the entries in memory only.
+            function: Called as callback(entry) with the dict of every entry
+            bool or str: Runs cProfile during training; a file name also dumps the stats there (see pstats)
+            bool: Traces allocations with tracemalloc, adding the current and peak traced bytes to the entries
+        """
+        if trace_memory and tracemalloc is None:
+            raise ValueError("Tracing memory requires tracemalloc (Python 3.4 or later)")
+        self.log = log
+        self.callback = callback
+        self.profile = profile
+        self.trace_memory = trace_memory
+
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.entries = []
+        self.profiler = None
+        self.peak_memory = None
+
+        self._file = None
+        self._owns_file = False
+        self._owns_tracing = False
+        self._started = None
+        self._last = None
+        self._last_times = None
+
+    def start(self):
+        """Resets the timers and starts logging, profiling and memory tracing"""
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.entries = []
+        self.peak_memory = None
+
+        if isinstance(self.log, str):
+            self._file = open(self.log, 'w')
+            self._owns_file = True
+        else:
+            self._file = self.log
+            self._owns_file = False
+
+        if self.trace_memory:
+            self._owns_tracing = not tracemalloc.is_tracing()
+            if self._owns_tracing:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self._started = self._last = _clock()
+        self._last_times = dict(self.times)
+
+    def stop(self, **fields):
+        """Stops profiling and memory tracing and records the summary entry
+
+        Params:
+            **fields: Extra values of the summary, e.g. the outcome of the training
+
+        Returns:
+            dict: Summary entry
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+            if isinstance(self.profile, str):
+                self.profiler.dump_stats(self.profile)
+
+        entry = {
+            'event': "summary",
+            'elapsed': _clock() - self._started,
+            'phases': dict(self.times),
+            'calls': dict(self.calls),
+        }
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            entry['peak_memory'] = self.peak_memory
+            if self._owns_tracing:
+                tracemalloc.stop()
+        entry.update(fields)
+        self._emit(entry)
+
+        if self._owns_file:
+            self._file.close()
+        self._file = None
+        return entry
+
+    def timed(self, phase, func, *args):
+        """Calls func(*args), adding its duration to the phase
+
+        Returns:
+            Return value of func
+        """
+        start = _clock()
+        try:
+            return func(*args)
+        finally:
+            self.times[phase] += _clock() - start
+            self.calls[phase] += 1
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """Context manager adding the duration of its block to the phase"""
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.times[phase] += _clock() - start
+            self.calls[phase] += 1
+
+    def iteration(self, iteration, **fields):
+        """Records the telemetry of a finished iteration
+
+        The time of the iteration not spent in a network phase is attributed to the optimizer.
+
+        Params:
+            int: Index of the iteration, starting from 1
+            **fields: Values of the iteration, e.g. cost, grad_norm and evaluations
+
+        Returns:
+            dict: Entry of the iteration
+        """
+        now = _clock()
+        seconds = now - self._last
+        phases = dict((phase, self.times[phase] - self._last_times[phase]) for phase in PHASES)
+        other = max(0.0, seconds - sum(phases.values()))
+        phases[OPTIMIZER] += other
+        self.times[OPTIMIZER] += other
+        self.calls[OPTIMIZER] += 1
+
+        entry = {
+            'event': "iteration",
+            'iteration': iteration,
+            'elapsed': now - self._started,
+            'seconds': seconds,
+            'phases': phases,
+        }
+        if self.trace_memory:
+            entry['memory'], entry['peak_memory'] = tracemalloc.get_traced_memory()
+        entry.update(fields)
+        self._emit(entry)
+
+        # Excludes the time spent logging from the next iteration
+        self._last = _clock()
+        self._last_times = dict(self.times)
+        return entry
+
+    def _emit(self, entry):
+        self.entries.append(entry)
+        if self._file is not None:
+            self._file.write(json.dumps(entry, sort_keys=True) + "\n")
+            self._file.flush()
+        if self.callback is not None:
+            self.callback(entry)
+
+    def stats(self, sort='cumulative', limit=20):
+        """Formats the cProfile statistics of the last run
+
+        Params:
+            str: Sort key of pstats, e.g. 'cumulative' or 'tottime'
+            int: Maximum # of functions listed
+
+        Returns:
+            str: Statistics table, empty if profiling was off
+        """
+        if self.profiler is None:
+            return ""
+        stream = StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
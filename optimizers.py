@@ -0,0 +1,172 @@
+"""Mini-batch stochastic optimizers used by ForwardNN.Trainer.
+
+Each optimizer updates a flat parameter array in place from a flat gradient array of the same size,
+so it can work directly on ForwardNN.params.
+"""
+import numpy as np
+
+__author__ = 'John Bucknam & Bill Clark'
+
+
+def constant(learning_rate):
+    """Learning rate schedule that never changes
+
+    Returns:
+        function: Maps the step number to the learning rate
+    """
+    return lambda step: learning_rate
+
+
+def step_decay(learning_rate, drop=0.5, every=1000):
+    """Learning rate schedule multiplied by drop after every given number of steps
+
+    Returns:
+        function: Maps the step number to the learning rate
+    """
+    return lambda step: learning_rate * drop ** (step // every)
+
+
+def exponential_decay(learning_rate, rate=0.96, every=1000):
+    """Learning rate schedule decaying smoothly by rate every given number of steps
+
+    Returns:
+        function: Maps the step number to the learning rate
+    """
+    return lambda step: learning_rate * rate ** (float(step) / every)
+
+
+def inverse_time_decay(learning_rate, rate=1.0, every=1000):
+    """Learning rate schedule of learning_rate / (1 + rate * step / every)
+
+    Returns:
+        function: Maps the step number to the learning rate
+    """
+    return lambda step: learning_rate / (1 + rate * float(step) / every)
+
+
+class Optimizer(object):
+    """Base class of the stochastic optimizers
+
+    The learning rate is either a float or a schedule, a function of the step number (see constant).
+    """
+
+    def __init__(self, learning_rate):
+        """Constructor
+
+        Params:
+            float or function: Learning rate, or schedule mapping the step number to the learning rate
+        """
+        if callable(learning_rate):
+            self.schedule = learning_rate
+        else:
+            self.schedule = constant(learning_rate)
+        self.iterations = 0
+
+    def reset(self):
+        """Forgets the state accumulated by previous steps"""
+        self.iterations = 0
+
+    def step(self, params, grad):
+        """Updates params in place from its gradients
+
+        Params:
+            ndarray: 1-D array of parameters, modified in place
+            ndarray: 1-D array of gradients of the same size
+        """
+        self._update(params, grad, self.schedule(self.iterations))
+        self.iterations += 1
+
+    def _update(self, params, grad, learning_rate):
+        raise NotImplementedError
+
+
+class SGD(Optimizer):
+    """Stochastic gradient descent with optional classical or Nesterov momentum"""
+
+    def __init__(self, learning_rate=0.1, momentum=0.0, nesterov=False):
+        """Constructor
+
+        Params:
+            float or function: Learning rate or schedule
+            float: Momentum coefficient; 0 disables momentum
+            bool: Uses Nesterov's accelerated gradient instead of classical momentum
+        """
+        super(SGD, self).__init__(learning_rate)
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.velocity = None
+
+    def reset(self):
+        super(SGD, self).reset()
+        self.velocity = None
+
+    def _update(self, params, grad, learning_rate):
+        if self.momentum == 0:
+            params -= learning_rate * grad
+            return
+
+        if self.velocity is None:
+            self.velocity = np.zeros_like(params)
+
+        # v = momentum * v - learning_rate * grad
+        self.velocity *= self.momentum
+        self.velocity -= learning_rate * grad
+
+        if self.nesterov:
+            # Steps from the look-ahead position: params += momentum * v - learning_rate * grad
+            params += self.momentum * self.velocity
+            params -= learning_rate * grad
+        else:
+            params += self.velocity
+
+
+class Adam(Optimizer):
+    """Adam: adaptive moment estimation (Kingma & Ba)"""
+
+    def __init__(self, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        """Constructor
+
+        Params:
+            float or function: Learning rate or schedule
+            float: Decay rate of the first moment estimate
+            float: Decay rate of the second moment estimate
+            float: Small value preventing division by zero
+        """
+        super(Adam, self).__init__(learning_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.m = None
+        self.v = None
+        self._scratch = None
+
+    def reset(self):
+        super(Adam, self).reset()
+        self.m = None
+        self.v = None
+        self._scratch = None
+
+    def _update(self, params, grad, learning_rate):
+        if self.m is None:
+            self.m = np.zeros_like(params)
+            self.v = np.zeros_like(params)
+            self._scratch = np.empty_like(params)
+
+        t = self.iterations + 1
+        scratch = self._scratch
+
+        # Biased first and second moment estimates
+        self.m *= self.beta1
+        self.m += (1 - self.beta1) * grad
+        np.multiply(grad, grad, out=scratch)
+        scratch *= 1 - self.beta2
+        self.v *= self.beta2
+        self.v += scratch
+
+        # Bias correction is folded into the step size
+        step_size = learning_rate * np.sqrt(1 - self.beta2 ** t) / (1 - self.beta1 ** t)
+        np.sqrt(self.v, out=scratch)
+        scratch += self.epsilon
+        np.divide(self.m, scratch, out=scratch)
+        scratch *= step_size
+        params -= scratch
@@ -0,0 +1,221 @@
+"""Data-parallel cost and gradient evaluation of a ForwardNN, and pools of tasks sharing the training data.
+
+The training data is split into contiguous shards, one per worker process, and placed in shared memory
+once. On every evaluation the weights are written to a shared buffer, each worker computes the cost and
+gradient of its shard into its own row of a shared gradient buffer, and the rows are reduced in this
+process. Only the shard index and the shard's cost pass through pickling.
+
+A TaskPool runs independent tasks, such as the restarts of the restarts module or the trials of the search
+module, in worker processes that map the training data from shared memory instead of receiving it with
+every task.
+
+Each worker already runs its own matrix products, so a multithreaded BLAS should be limited to one
+thread (e.g. OMP_NUM_THREADS=1) to keep the workers from oversubscribing the cores.
+"""
+import multiprocessing
+
+import numpy as np
+
+import ForwardNN
+import inputs
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Shared buffers and networks of the current worker process, set once by _init_worker
+_worker = {}
+
+
+def share(array, dtype):
+    """Copies an array into shared memory
+
+    Returns:
+        RawArray: Shared buffer holding the array's bytes
+        tuple: Shape of the array
+    """
+    array = np.asarray(array, dtype=dtype)
+    raw = multiprocessing.RawArray('b', max(1, array.nbytes))
+    np.frombuffer(raw, dtype=dtype, count=array.size)[:] = array.ravel()
+    return raw, array.shape
+
+
+def view(raw, shape, dtype):
+    """Maps a shared buffer as an array, without copying it"""
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def share_input(x, dtype):
+    """Places inputs in shared memory; compact inputs (see the inputs module) are kept as they are,
+    small enough to be pickled once per worker
+
+    Returns:
+        tuple: Handle of the inputs for open_input
+    """
+    if inputs.is_compact(x):
+        return x, None
+    return share(x, dtype)
+
+
+def open_input(handle, dtype):
+    """Returns:
+        ndarray, sparse matrix or PackedBits: Inputs given to share_input, mapped without copying
+    """
+    data, shape = handle
+    if shape is None:
+        return data
+    return view(data, shape, dtype)
+
+
+def _init_worker(x_handle, y_raw, y_shape, params_raw, grad_raw, grad_shape, shards, layer_sizes,
+                 network_kwargs):
+    """Maps the shared data, weights and gradients into the worker, without copying them"""
+    dtype = np.dtype(network_kwargs.get('dtype', np.float64))
+    _worker['x'] = open_input(x_handle, dtype)
+    _worker['y'] = view(y_raw, y_shape, dtype)
+    _worker['params'] = view(params_raw, (grad_shape[1],), np.float64)
+    _worker['grad'] = view(grad_raw, grad_shape, np.float64)
+    _worker['shards'] = shards
+    _worker['layer_sizes'] = layer_sizes
+    _worker['network_kwargs'] = network_kwargs
+    # One network per shard size, each keeping a workspace for its # of rows
+    _worker['networks'] = {}
+
+
+def _evaluate(shard):
+    """Computes the cost and gradient of one shard at the shared weights
+
+    Params:
+        int: Index of the shard; its gradient is written into that row of the shared gradients
+
+    Returns:
+        float: Cost of the shard
+    """
+    start, end = _worker['shards'][shard]
+    rows = end - start
+    NN = _worker['networks'].get(rows)
+    if NN is None:
+        NN = ForwardNN.ForwardNN(_worker['layer_sizes'], **_worker['network_kwargs'])
+        NN.allocate_workspace(rows)
+        _worker['networks'][rows] = NN
+
+    cost, grad = NN.value_and_grad(_worker['params'], _worker['x'][start:end], _worker['y'][start:end])
+    _worker['grad'][shard] = grad
+    return cost
+
+
+class ShardedEvaluator(object):
+    """Evaluates the cost and gradient of a network over data sharded across worker processes"""
+
+    def __init__(self, NN, x, y, workers=None):
+        """Constructor
+
+        Params:
+            ForwardNN: Network whose layer sizes and settings the workers copy; its weights are not used
+            ndarray: Input value for the Neural Network
+            ndarray: Expected output value from the Neural Network
+            int: Number of worker processes and shards; None uses every core
+        """
+        if x.shape[0] != y.shape[0]:
+            raise ValueError("Need equal number of Inputs and Outputs")
+        workers = workers or multiprocessing.cpu_count()
+        workers = max(1, min(workers, x.shape[0]))
+        self.rows = x.shape[0]
+        bounds = np.linspace(0, self.rows, workers + 1).astype(int)
+        self.shards = [(int(bounds[i]), int(bounds[i + 1])) for i in range(workers)]
+
+        # Costs are means over the rows of a shard. So are the gradients of a loss, while the legacy
+        # gradients (loss=None) are sums, which add up across shards as they are
+        self._cost_weights = np.array([end - start for start, end in self.shards], dtype=np.float64) / self.rows
+        self._grad_weights = self._cost_weights if NN.loss is not None else np.ones(workers)
+
+        config = NN.get_config()
+        x_handle = share_input(x, NN.dtype)
+        y_raw, y_shape = share(y, NN.dtype)
+        params_raw, _ = share(np.zeros(NN.params.size), np.float64)
+        grad_raw, grad_shape = share(np.zeros((workers, NN.params.size)), np.float64)
+        self._params = view(params_raw, (NN.params.size,), np.float64)
+        self._grads = view(grad_raw, grad_shape, np.float64)
+        self._grad = np.empty(NN.params.size)
+
+        self._pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                          initargs=(x_handle, y_raw, y_shape, params_raw, grad_raw, grad_shape,
+                                                    self.shards, NN.layerSizes, config))
+
+    def value_and_grad(self, params):
+        """Cost and gradient of the whole data at the given weights
+
+        Params:
+            ndarray: 1-D array of weights, laid out as in ForwardNN.get_params
+
+        Returns:
+            float: Cost of the data, as ForwardNN.value_and_grad would compute it in one process
+            ndarray: 1-D float64 array of gradients; Buffer owned by the evaluator, overwritten on the next call
+        """
+        np.copyto(self._params, params)
+        costs = self._pool.map(_evaluate, range(len(self.shards)))
+        np.dot(self._grad_weights, self._grads, out=self._grad)
+        return float(np.dot(self._cost_weights, costs)), self._grad
+
+    def close(self):
+        """Stops the worker processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _init_tasks(initializer, x_handle, y_raw, y_shape, dtype, *initargs):
+    """Maps the shared training data into the worker and hands it to the initializer of the tasks"""
+    initializer(open_input(x_handle, dtype), view(y_raw, y_shape, dtype), *initargs)
+
+
+class TaskPool(object):
+    """Runs tasks in worker processes sharing the training data, or in this process"""
+
+    def __init__(self, x, y, dtype, initializer, initargs=(), workers=None):
+        """Constructor
+
+        Params:
+            ndarray: Input value for the Neural Networks; compact inputs are pickled once per worker
+            ndarray: Expected output value from the Neural Networks
+            dtype: Dtype the data is shared and mapped in
+            function: Called as initializer(x, y, *initargs) once in every worker with the mapped data
+            tuple: Further arguments of the initializer
+            int: Number of worker processes; None uses every core, 1 runs the tasks in this process
+        """
+        x_handle = share_input(x, dtype)
+        y_raw, y_shape = share(y, dtype)
+        initargs = (initializer, x_handle, y_raw, y_shape, dtype) + tuple(initargs)
+        self._pool = None
+        if workers == 1:
+            _init_tasks(*initargs)
+        else:
+            self._pool = multiprocessing.Pool(workers, initializer=_init_tasks, initargs=initargs)
+
+    def imap_unordered(self, function, tasks):
+        """Runs function on every task
+
+        Returns:
+            iterator: Results as the tasks finish; in the order of the tasks in this process
+        """
+        if self._pool is None:
+            return (function(task) for task in tasks)
+        return self._pool.imap_unordered(function, tasks)
+
+    def close(self):
+        """Stops the worker processes, cancelling the tasks still queued or running"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,72 @@
+"""Replay buffer of past training data for online updates of a ForwardNN.
+
+Online updates (Trainer.partial_fit) train on a few new data points; mixing in a sample of the data
+seen before keeps the network from forgetting it. The buffer holds a fixed-size uniform sample of every
+data point added so far (reservoir sampling), in preallocated arrays.
+"""
+import numpy as np
+
+__author__ = 'John Bucknam & Bill Clark'
+
+
+class ReplayBuffer(object):
+    """Fixed-capacity uniform sample of the data points seen so far"""
+
+    def __init__(self, capacity, input_size, output_size, dtype=np.float64, seed=None):
+        """Constructor
+
+        Params:
+            int: Maximum # of data points kept
+            int: # of values of each input
+            int: # of values of each expected output
+            dtype: Type of the stored values, normally the network's dtype
+            int: Seed of the sampling
+        """
+        self.capacity = capacity
+        self.x = np.empty((capacity, input_size), dtype=dtype)
+        self.y = np.empty((capacity, output_size), dtype=dtype)
+        self.size = 0
+        self.seen = 0
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, x, y):
+        """Adds data points, each kept with probability capacity / # of data points seen
+
+        Params:
+            ndarray: [n, input_size] inputs
+            ndarray: [n, output_size] expected outputs
+        """
+        x = np.atleast_2d(x)
+        y = np.atleast_2d(y)
+        if x.shape[0] != y.shape[0]:
+            raise ValueError("Need equal number of Inputs and Outputs")
+
+        # Fills the free slots first, then replaces random slots
+        free = min(self.capacity - self.size, x.shape[0])
+        self.x[self.size:self.size + free] = x[:free]
+        self.y[self.size:self.size + free] = y[:free]
+        self.size += free
+        self.seen += free
+        for i in range(free, x.shape[0]):
+            self.seen += 1
+            slot = self.random.randint(0, self.seen)
+            if slot < self.capacity:
+                self.x[slot] = x[i]
+                self.y[slot] = y[i]
+
+    def sample(self, count):
+        """Draws distinct stored data points
+
+        Params:
+            int: # of data points, at most the # stored
+
+        Returns:
+            ndarray: [count, input_size] inputs
+            ndarray: [count, output_size] expected outputs
+        """
+        count = min(count, self.size)
+        indices = self.random.choice(self.size, count, replace=False)
+        return self.x[indices], self.y[indices]
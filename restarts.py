@@ -0,0 +1,149 @@
+"""Parallel Monte Carlo restarts of ForwardNN training.
+
+Each restart trains a freshly initialized network, and the network with the lowest cost is kept.
+Restarts are independent, so they are spread over a pool of worker processes. The training data is
+placed in shared memory once and mapped by every worker instead of being pickled with each task.
+train_ensemble keeps the several best networks instead, as an ensemble.Ensemble.
+"""
+import numpy as np
+
+import ForwardNN
+import ensemble
+import parallel
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Training data and settings of the current process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(x, y, layer_sizes, network_kwargs, trainer_kwargs):
+    """Keeps the training data mapped by the TaskPool and the settings of the restarts"""
+    _worker['x'] = x
+    _worker['y'] = y
+    _worker['layer_sizes'] = layer_sizes
+    _worker['network_kwargs'] = network_kwargs
+    _worker['trainer_kwargs'] = trainer_kwargs
+
+
+def _run_trial(task):
+    """Trains one network from a seeded random start
+
+    Params:
+        tuple: Trial index, seed, and initial weights or None for random weights
+
+    Returns:
+        int: Trial index
+        float: Validation cost of the trained network, or its training cost without a validation set
+        ndarray: 1-D array of the trained weights
+    """
+    index, seed, params = task
+    x, y = _worker['x'], _worker['y']
+
+    np.random.seed(seed)
+    NN = ForwardNN.ForwardNN(_worker['layer_sizes'], **_worker['network_kwargs'])
+    if params is not None:
+        NN.set_params(params)
+    trainer = ForwardNN.Trainer(NN, **_worker['trainer_kwargs'])
+    trainer.train(x, y)
+
+    # Networks are compared on held-out data when there is some; the training cost is known from training
+    cost = trainer.validation_cost
+    if cost is None:
+        cost = trainer.cost if trainer.cost is not None else NN.cost_function(x, y)
+    return index, cost, NN.get_params().copy()
+
+
+def _restarts(layer_sizes, x, y, trials, workers, seed, target_cost, initial_params, network_kwargs,
+              trainer_kwargs, callback, keep):
+    """Runs the restarts of monte_carlo and train_ensemble
+
+    Returns:
+        list: (float, ndarray) cost and weights of at most keep networks, lowest cost first, NaN costs left out
+        float: Lowest cost, NaN if every cost was NaN
+    """
+    network_kwargs = network_kwargs or {}
+    trainer_kwargs = trainer_kwargs or {}
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=trials)
+    tasks = [(i, seeds[i], initial_params if i == 0 else None) for i in range(trials)]
+
+    best_cost = None
+    kept = []
+    # The workers map the data in the dtype of the networks, as the networks would convert it anyway
+    dtype = np.dtype(network_kwargs.get('dtype', np.float64))
+    with parallel.TaskPool(x, y, dtype, _init_worker, (layer_sizes, network_kwargs, trainer_kwargs), workers) as pool:
+        # Leaving the pool cancels the restarts still queued or running
+        for index, cost, params in pool.imap_unordered(_run_trial, tasks):
+            # NaN costs never compare lower, so such networks are only kept until a valid one finishes
+            if best_cost is None or np.isnan(best_cost) or cost < best_cost:
+                best_cost = cost
+            if not np.isnan(cost):
+                # Stable sort: of equal costs, the network that finished first stays ahead
+                kept.append((cost, params))
+                kept.sort(key=lambda item: item[0])
+                del kept[keep:]
+            if callback is not None:
+                callback(index, cost, best_cost)
+            if target_cost is not None and best_cost <= target_cost:
+                break
+    return kept, best_cost
+
+
+def monte_carlo(layer_sizes, x, y, trials, workers=None, seed=None, target_cost=None, initial_params=None,
+                network_kwargs=None, trainer_kwargs=None, callback=None):
+    """Trains several randomly initialized networks in parallel and keeps the best one
+
+    Params:
+        tuple: Layer sizes of the networks
+        ndarray: Input value for the Neural Networks
+        ndarray: Expected output value from the Neural Networks
+        int: Number of restarts
+        int: Number of worker processes; None uses every core, 1 trains in this process
+        int: Seed from which the seed of every restart is drawn, so results do not depend on scheduling
+        float: Stops the remaining restarts as soon as a network reaches this cost or lower
+        ndarray: Weights the first restart starts from instead of random weights
+        dict: Keyword arguments given to every ForwardNN, e.g. dtype
+        dict: Keyword arguments given to every Trainer, e.g. a validation set to compare the networks on
+        function: Called as callback(index, cost, best_cost) after each finished restart
+
+    Returns:
+        ForwardNN: Network with the lowest cost, None if every cost was NaN
+        float: Its cost
+    """
+    kept, best_cost = _restarts(layer_sizes, x, y, trials, workers, seed, target_cost, initial_params,
+                                network_kwargs, trainer_kwargs, callback, 1)
+    if not kept:
+        return None, best_cost
+    NN = ForwardNN.ForwardNN(layer_sizes, **(network_kwargs or {}))
+    NN.set_params(kept[0][1])
+    return NN, best_cost
+
+
+def train_ensemble(layer_sizes, x, y, trials, size, workers=None, seed=None, initial_params=None,
+                   network_kwargs=None, trainer_kwargs=None, callback=None, combine=ensemble.Ensemble.MEAN):
+    """Trains several randomly initialized networks in parallel and keeps the best ones as an ensemble
+
+    Params:
+        tuple: Layer sizes of the networks
+        ndarray: Input value for the Neural Networks
+        ndarray: Expected output value from the Neural Networks
+        int: Number of restarts
+        int: Number of networks kept, at most the # of restarts
+        int: Number of worker processes; None uses every core, 1 trains in this process
+        int: Seed from which the seed of every restart is drawn, so results do not depend on scheduling
+        ndarray: Weights the first restart starts from instead of random weights
+        dict: Keyword arguments given to every ForwardNN, e.g. dtype
+        dict: Keyword arguments given to every Trainer, e.g. a validation set to compare the networks on
+        function: Called as callback(index, cost, best_cost) after each finished restart
+        str: Combination of the outputs, ensemble.Ensemble.MEAN or ensemble.Ensemble.VOTE
+
+    Returns:
+        Ensemble: Networks with the lowest costs, the best first; None if every cost was NaN
+        list: float; Their costs
+    """
+    kept, _ = _restarts(layer_sizes, x, y, trials, workers, seed, None, initial_params, network_kwargs,
+                        trainer_kwargs, callback, size)
+    if not kept:
+        return None, []
+    models = ensemble.Ensemble.from_params(layer_sizes, [params for _, params in kept], network_kwargs, combine)
+    return models, [cost for cost, _ in kept]
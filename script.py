@@ -1,30 +1,65 @@
 #!/usr/bin/env python
 
 import ForwardNN
+import activations
+import checkpoint
+import dataset
+import ensemble
+import inputs
+import optimizers
+import replay
+import restarts
 import numpy as np
 import argparse
 import os.path
+import re
 
 np.set_printoptions(threshold='nan')
 
 # Reads in file as an array of arrays.
 def readFile(name):
-    fileX = []
-    for line in name:
-        fileX.append([float(y) for y in line.split(' ')])
-    return np.array(fileX)
+    return dataset.read_matrix(name)
 
+# Reads in the layers, weights and network settings saved by save. Older text files hold
+# the layers on the first line and the weights separated by spaces on the second.
 def read_params(name):
+    if checkpoint.is_checkpoint(name):
+        NN = checkpoint.load(name)
+        return [NN.layerSizes, NN.get_params(), NN.get_config()]
+
     prev = []
-    firstline = name.readline()
-    layer = ()
-    for arg in firstline:
-        layer = layer + (int(arg),)
-    prev.append(layer)
-    prev.append(np.fromstring(name.readline(), dtype=float, sep=" "))
+    with open(name, 'r') as weights:
+        firstline = weights.readline()
+        layer = tuple(int(arg) for arg in re.findall(r"\d+", firstline))
+        prev.append(layer)
+        prev.append(np.fromstring(weights.readline(), dtype=float, sep=" "))
+        prev.append({})
     return prev
 
-def forward(testfile, infile, outfile, NN):
+# Copies of a correction in each update, and past data points sampled from the replay buffer along with them.
+# Weighting the correction keeps a few steps from being spent on fitting the data learned before.
+CORRECTION_WEIGHT = 8
+REPLAY_SAMPLE = 16
+# Learning rate of the Adam steps learning a correction
+ONLINE_LEARNING_RATE = 0.3
+
+# Trains every learner on a correction weighted against a sample of the replay buffer, which then keeps it.
+def learn(input, expected, learners, buffer, steps):
+    x = np.repeat(input, CORRECTION_WEIGHT, axis=0)
+    y = np.repeat(expected, CORRECTION_WEIGHT, axis=0)
+    if buffer is not None and len(buffer):
+        past_x, past_y = buffer.sample(REPLAY_SAMPLE)
+        x = np.concatenate((x, past_x))
+        y = np.concatenate((y, past_y))
+    for learner in learners:
+        learner.partial_fit(x, y, steps=steps)
+    if buffer is not None:
+        buffer.add(input, expected)
+
+# Forwards the inputs of a file and asks whether the outputs are right. A correction is appended to
+# the training data and, given learners, learned right away. Given an ensemble, its combined outputs
+# are shown, NN is its first network and there is one learner for each of its networks.
+def forward(testfile, infile, outfile, NN, learners=None, buffer=None, steps=20, models=None):
     try:
         inputFile = open(testfile, 'r')
         input = readFile(inputFile)
@@ -33,7 +68,7 @@ def forward(testfile, infile, outfile, NN):
         print("ERROR: Invalid file input")
         return False
 
-    print(np.around(NN.forward(input), decimals=2))
+    print(np.around(NN.forward(input) if models is None else models.predict(input), decimals=2))
 
     # Additional checker tool, allows for a forwarded file to be added to test data.
     valid = raw_input("Is this the expected output? (y/n): ")
@@ -41,6 +76,9 @@ def forward(testfile, infile, outfile, NN):
         actualOutput = raw_input("What is the correct output: ")
         try:
             actualOutput = int(actualOutput)
+            if not 0 <= actualOutput < NN.outputLayerSize:
+                raise ValueError("Output out of range")
+            label = actualOutput
             with open(infile, "a") as trainInput:
                 with open(testfile, "r") as newInput:
                     trainInput.write(newInput.read())
@@ -65,55 +103,90 @@ def forward(testfile, infile, outfile, NN):
                         zeroes = zeroes - 1
                 trainOutput.write(newData)
                 trainOutput.close()
+            if not learners:
                 print("Is added to training data. Will not be implemented until restart.")
+            else:
+                expected = np.zeros((input.shape[0], NN.outputLayerSize))
+                expected[:, label] = 1
+                learn(input, expected, learners, buffer, steps)
+                if models is None:
+                    output = NN.forward(input)
+                else:
+                    for index, learner in enumerate(learners):
+                        models.set_params(index, learner.neural_net.get_params())
+                    output = models.predict(input)
+                print(np.around(output, decimals=2))
+                if np.all(output.argmax(axis=1) == label):
+                    print("Is added to training data and learned.")
+                else:
+                    print("Is added to training data, but was not learned (" + str(learners[0].message) +
+                          "). Will be implemented on restart.")
         except ValueError:
             print("ERROR: Invalid input.")
             return False
     return True
 
-def save(filename):
+def save(filename, NN):
     if filename == "default":
-        filename = "Weights-" + str(layerNodes)
-        return True
-
-    with open(filename, "w") as weights:
-        print "Saving weights in " + filename
-        weights.write(str(NN.get_params()).replace("[", "").replace("]","")
-                      .replace("\n", "").replace("   "," ").replace("  ", " "))
-        weights.close()
+        filename = "Weights-" + str(NN.layerSizes).replace(" ", "")
+
+    print "Saving weights in " + filename
+    checkpoint.save(NN, filename)
     return True
 
-def train(max_count, NN, layerNodes, X, Y):
-    bestNN = ForwardNN.ForwardNN(layerNodes)
-    bestNN.set_params(NN.get_params())
+# Prints the cost of every finished cycle, and the best cost so far when it improves.
+def cycle_report():
+    def report(index, cost, best_cost):
+        if cost == best_cost:
+            print("New cost: " + str(cost))
+        report.count += 1
+        print("Current cycle: " + str(report.count))
+    report.count = 0
+    return report
 
-    # This is our monte carlo. Continually trains networks until one statisfies our conditions.
+def train(max_count, NN, layerNodes, X, Y, workers=1, trainer_kwargs=None):
+    # This is our monte carlo. Trains max_count networks, the first starting from the given weights,
+    # spread over the given number of processes, and keeps the one with the lowest cost (on the
+    # validation set when trainer_kwargs holds one). The first cycle continues training the given
+    # weights, so the best network replaces them without evaluating their cost again.
     if max_count > 0:
-        count = 0
-        while np.isnan(bestNN.cost_function(X, Y)) or count < max_count:
-            train = ForwardNN.Trainer(NN)
-            train.train(X, Y)
-            if bestNN.cost_function(X, Y) > NN.cost_function(X, Y):
-                bestNN = ForwardNN.ForwardNN(layerNodes)
-                bestNN.set_params(NN.get_params())
-                print("New cost: " + str(bestNN.cost_function(X, Y)))
-            count += 1
-            NN = ForwardNN.ForwardNN(layerNodes)
-            print("Current cycle: " + str(count))
-
-        NN.set_params(bestNN.get_params())
+        bestNN, cost = restarts.monte_carlo(layerNodes, X, Y, max_count, workers=workers,
+                                            initial_params=NN.get_params(), network_kwargs=NN.get_config(),
+                                            trainer_kwargs=trainer_kwargs, callback=cycle_report())
+        if bestNN is not None:
+            NN = bestNN
     return NN
 
+# Like train, but keeps the size best of the max_count networks as an ensemble combining their outputs,
+# the best network first. Returns None when no cycle ran or every cost was NaN.
+def train_ensemble(max_count, size, combine, NN, layerNodes, X, Y, workers=1, trainer_kwargs=None):
+    if max_count <= 0:
+        return None
+    models, costs = restarts.train_ensemble(layerNodes, X, Y, max_count, size, workers=workers,
+                                            initial_params=NN.get_params(), network_kwargs=NN.get_config(),
+                                            trainer_kwargs=trainer_kwargs, callback=cycle_report(),
+                                            combine=combine)
+    if models is not None:
+        print("Kept the " + str(models.size) + " best cycles, costs: " + str(costs))
+    return models
+
 
 # In place of a main, as python lacks one. Call run to read in the training data and train,
 # As well as run a monte carlo to find a satisfactory network. Then it will sit in a loop
 # waiting for input commands.
 def visual(argv):
     print argv
-    X = readFile(argv.input[0])
+    # Parses the data, or memory-maps it from its .npy cache when asked to. Inputs can instead be
+    # kept sparse or packed 1 bit per value.
     argv.input[0].close()
-    Y = readFile(argv.output[0])
     argv.output[0].close()
+    if argv.inputs == "sparse":
+        X = dataset.read_sparse(argv.input[0].name)
+    elif argv.inputs == "bits":
+        X = dataset.read_bits(argv.input[0].name)
+    else:
+        X = dataset.load(argv.input[0].name, cache=argv.cache)
+    Y = dataset.load(argv.output[0].name, cache=argv.cache)
 
     if not X.shape[0] == Y.shape[0]:
         print "ERROR: Need equal number of Inputs and Outputs"
@@ -128,23 +201,29 @@ def visual(argv):
     layerNodes = None
     params = None
 
+    # Activations and loss of new networks
+    activation = argv.activation
+    if activation is not None and len(activation) == 1:
+        activation = activation[0]
+
     if not argv.params == None:
-        params = read_params(argv.params[0])
-        argv.params[0].close()
-        if params[0][0] == X.shape[1] and params[0][len(params[0])] == Y.shape[1]:
+        params = read_params(argv.params)
+        if params[0][0] == X.shape[1] and params[0][len(params[0]) - 1] == Y.shape[1]:
             layerNodes = params[0]
-            NN = ForwardNN.ForwardNN(layerNodes)
+            NN = ForwardNN.ForwardNN(layerNodes, **params[2])
             NN.set_params(params[1])
         else:
             print "ERROR: Invalid layers given by parameters"
             return
     elif not argv.layers == None:
         layerNodes = (X.shape[1],) + tuple(argv.layers,) + (Y.shape[1],)
-        NN = ForwardNN.ForwardNN(layerNodes)
+        NN = ForwardNN.ForwardNN(layerNodes, activation=activation, loss=argv.loss, bias=argv.bias,
+                                 init=argv.init)
         print("Neural Network Layers: " + str(layerNodes))
     else:
         layerNodes = (X.shape[1],) + (Y.shape[1],)
-        NN = ForwardNN.ForwardNN(layerNodes)
+        NN = ForwardNN.ForwardNN(layerNodes, activation=activation, loss=argv.loss, bias=argv.bias,
+                                 init=argv.init)
         print("Neural Network Layers: " + str(layerNodes))
 
 
@@ -154,13 +233,52 @@ def visual(argv):
     print("Cost Function: " + NN.cost_function_type(X, Y))
     print("Cost: " + str(NN.cost_function(X, Y)))
 
-    # Trains the network using the trainer and test data.
-    NN = train(argv.cycle[0], NN, layerNodes, X, Y)
+    # Holds out a random part of the data to stop training once the cost on it stops improving.
+    trainer_kwargs = {}
+    if argv.data_parallel is not None:
+        trainer_kwargs['data_parallel'] = argv.data_parallel
+    trainX, trainY = X, Y
+    if argv.validation > 0:
+        order = np.random.permutation(X.shape[0])
+        held = max(1, int(round(argv.validation * X.shape[0])))
+        trainX, trainY = X[order[held:]], Y[order[held:]]
+        trainer_kwargs['validation'] = (X[order[:held]], Y[order[:held]])
+        trainer_kwargs['patience'] = argv.patience
+        print("Holding out " + str(held) + " data points for validation.")
+
+    # Trains the network using the trainer and test data, or keeps the best cycles as an ensemble.
+    models = None
+    if argv.ensemble > 1:
+        models = train_ensemble(argv.cycle[0], argv.ensemble, argv.combine, NN, layerNodes, trainX, trainY,
+                                argv.workers, trainer_kwargs)
+        if models is not None:
+            NN = models.network(0)
+    else:
+        NN = train(argv.cycle[0], NN, layerNodes, trainX, trainY, argv.workers, trainer_kwargs)
 
     # Print the results of the training and monte carlo.
     print("Now printing the final match results.")
-    print(np.around(NN.forward(X), decimals=2))
-    print("Cost function: " + str(NN.cost_function(X, Y)))
+    if models is None:
+        print(np.around(NN.forward(X), decimals=2))
+        print("Cost function: " + str(NN.cost_function(X, Y)))
+    else:
+        output = models.predict(X)
+        print(np.around(output, decimals=2))
+        print("Ensemble of " + str(models.size) + " networks, best cost function: " + str(NN.cost_function(X, Y)))
+        print("Ensemble matches: " + str(np.sum(output.argmax(axis=1) == Y.argmax(axis=1))) + "/" + str(X.shape[0]))
+
+    # Learns corrections given to forward from the trained weights, mixed with the training data. Each
+    # network of an ensemble learns them, so its combined output follows. Adam steps only need the gradient:
+    # the line searches of L-BFGS-B end early once a correction's output is saturated or, without a loss,
+    # because the cost is not the one the gradient derives.
+    learners = []
+    buffer = None
+    if argv.online_steps > 0:
+        networks = [NN] if models is None else [NN] + [models.network(k) for k in range(1, models.size)]
+        learners = [ForwardNN.Trainer(network, optimizer=optimizers.Adam(ONLINE_LEARNING_RATE))
+                    for network in networks]
+        buffer = replay.ReplayBuffer(max(1000, X.shape[0]), X.shape[1], Y.shape[1], dtype=NN.dtype)
+        buffer.add(inputs.to_dense(X, NN.dtype), Y)
 
     # Input control loop.
     while 1:
@@ -170,12 +288,13 @@ def visual(argv):
 
         # When a user inputs forward and a file, read in the file and run forward using it.
         if ans.split(' ')[0] == 'forward' and len(ans.split(' ')) > 1:
-            forward(ans.split(' ')[1], argv.input[0].name, argv.output[0].name, NN)
+            forward(ans.split(' ')[1], argv.input[0].name, argv.output[0].name, NN, learners, buffer,
+                    argv.online_steps, models)
         elif ans.split(' ')[0] == 'save':
             if len(ans.split(' ')) <= 1:
-                save("default")
+                save("default", NN)
             else:
-                save(ans.split(' ')[1])
+                save(ans.split(' ')[1], NN)
         # Exit.
         elif ans.split(' ')[0] == 'exit':
             break
@@ -192,15 +311,50 @@ if __name__ == '__main__':
     parser.add_argument("output", metavar="O", type=argparse.FileType('r'), nargs=1, help="Expected output data")
     parser.add_argument("cycle", metavar="C", type=int, nargs=1,
                         help="Number of cycles used for training. Best cost function will be taken.")
-    parser.add_argument("--params", metavar="W", type=argparse.FileType('r'), nargs='?',
-                        help="File containing pre-existing weights and layers")
+    parser.add_argument("--params", metavar="W", type=str, default=None,
+                        help="File containing pre-existing weights and layers (saved by the save command)")
     parser.add_argument("--layers", type=int, nargs='*', const=None, default=None,
                         help="List of ints, containing the # of nodes for each hidden layer (Overwritten by params)")
+    parser.add_argument("--activation", nargs='+', default=None, choices=sorted(activations.ACTIVATIONS),
+                        help="Activation of every layer, or one per set of weights (Overwritten by params)")
+    parser.add_argument("--loss", default=None, choices=sorted(activations.LOSSES),
+                        help="Loss minimized by training (Overwritten by params)")
+    parser.add_argument("--bias", dest="bias", action="store_true",
+                        help="Adds a bias to every hidden and output node (Overwritten by params)")
+    parser.add_argument("--init", default=ForwardNN.ForwardNN.NORMAL_INIT,
+                        choices=[ForwardNN.ForwardNN.NORMAL_INIT, ForwardNN.ForwardNN.XAVIER_INIT,
+                                 ForwardNN.ForwardNN.HE_INIT],
+                        help="Scaling of the random initial weights")
+    parser.add_argument("--cache", dest="cache", action="store_true",
+                        help="Caches the parsed Inputs/Outputs next to them as .npy files for faster reloads")
+    parser.add_argument("--inputs", default="dense", choices=["dense", "sparse", "bits"],
+                        help="Format the inputs are held in: dense, sparse (only non-zero values) or bits "
+                             "(0/1 inputs packed 1 bit per value)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="# of processes training the cycles in parallel (0 uses every core)")
+    parser.add_argument("--data-parallel", type=int, default=None,
+                        help="Splits every gradient evaluation over this many processes (0 uses every core); "
+                             "requires --workers 1")
+    parser.add_argument("--ensemble", type=int, default=1,
+                        help="Keeps this many of the best cycles and combines their outputs (1 keeps only the best)")
+    parser.add_argument("--combine", default=ensemble.Ensemble.MEAN,
+                        choices=[ensemble.Ensemble.MEAN, ensemble.Ensemble.VOTE],
+                        help="Combination of the outputs of an ensemble: their mean, or each digit's share of votes")
+    parser.add_argument("--validation", type=float, default=0.0,
+                        help="Fraction of the data held out to stop training early (0 trains on everything)")
+    parser.add_argument("--patience", type=int, default=10,
+                        help="Validations without improvement before training stops (with --validation)")
+    parser.add_argument("--online-steps", type=int, default=20,
+                        help="Adam steps learning each correction given to forward (0 waits for a restart)")
     parser.add_argument("--visual", dest="visual", action="store_const", const=visual, default=visual,
                         help="Runs through Neural Network with visual")
 
-args = parser.parse_args()
-args.visual(args)
+    args = parser.parse_args()
+    if args.data_parallel is not None and args.workers != 1:
+        parser.error("--data-parallel requires --workers 1, as worker processes cannot start their own")
+    if args.workers == 0:
+        args.workers = None
+    args.visual(args)
 
 # META
 __author__ = 'Bill Clark & John Bucknam'
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""Hyperparameter search over ForwardNN configurations.
+
+A configuration is a dict of JSON values, e.g.
+
+    {"hidden": [20, 20], "activation": "tanh", "optimizer": "L-BFGS-B", "budget": 200}
+
+with the keys hidden (hidden layer sizes), activation (a name or one per set of weights), loss, bias,
+init, dtype ("float64" or "float32"), optimizer (Trainer.BFGS, Trainer.L_BFGS_B, or the stochastic "sgd"
+and "adam" with learning_rate and batch_size) and budget (iterations of the full-batch methods, epochs of
+the stochastic ones).
+
+Configurations come from a grid or random sampling of a search space, a dict mapping every key to its
+candidate values. Trials run in parallel worker processes sharing the data, and successive halving
+(and Hyperband on top of it) only gives larger budgets to the best trials of each round. Trials are
+ranked on the sum of squares of their predictions on the validation data (the training data without
+one), which compares networks trained with different losses. Every result is stored in an on-disk cache
+keyed by the configuration, budget, seed and a hash of the data, so repeated searches never train a
+configuration twice.
+
+Run `python search.py -h` for the command line options.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+
+import ForwardNN
+import activations
+import dataset
+import inputs
+import optimizers
+import parallel
+
+__author__ = 'John Bucknam & Bill Clark'
+
+# Stochastic optimizers a configuration can name, besides the full-batch methods
+OPTIMIZERS = {'sgd': optimizers.SGD, 'adam': optimizers.Adam}
+DEFAULT_BUDGET = 200
+DEFAULT_DTYPE = "float64"
+
+# Training data of the current process, set once by _init_worker
+_worker = {}
+
+
+def normalize(config):
+    """Returns the configuration as plain JSON values, so equal configurations have equal keys"""
+    return json.loads(json.dumps(config, sort_keys=True))
+
+
+def _candidates(space):
+    """Distinct candidate values of every key of a search space, in their first order
+
+    Returns:
+        dict: Maps every configuration key to a list of distinct normalized values
+    """
+    candidates = {}
+    for name in space:
+        values = []
+        seen = set()
+        for value in normalize(space[name]):
+            key = json.dumps(value, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                values.append(value)
+        candidates[name] = values
+    return candidates
+
+
+def grid(space):
+    """Every combination of the candidate values of a search space
+
+    Params:
+        dict: Maps every configuration key to a list of candidate values
+
+    Returns:
+        list: dict; Configurations
+    """
+    space = _candidates(space)
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def sample(space, count, seed=None):
+    """Distinct random configurations of a search space
+
+    Params:
+        dict: Maps every configuration key to a list of candidate values
+        int: # of configurations, fewer if the space is smaller
+        int: Seed of the sampling
+
+    Returns:
+        list: dict; Configurations
+    """
+    random = np.random.RandomState(seed)
+    space = _candidates(space)
+    names = sorted(space)
+    # Duplicated candidates would make the space look larger than its distinct configurations
+    size = int(np.prod([len(space[name]) for name in names]))
+    configs = []
+    seen = set()
+    while len(configs) < min(count, size):
+        config = dict((name, space[name][random.randint(len(space[name]))]) for name in names)
+        key = json.dumps(config, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def data_hash(*arrays):
+    """SHA-1 of the shapes, dtypes and values of arrays, read in chunks of at most 64 MiB
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        # Compact inputs are hashed through the arrays that hold them
+        if isinstance(array, inputs.PackedBits):
+            digest.update(json.dumps(['bits', array.columns]).encode('ascii'))
+            array = array.packed
+        elif sparse.issparse(array):
+            array = array.tocsr()
+            digest.update(json.dumps(['csr', array.shape]).encode('ascii'))
+            digest.update(data_hash(array.data, array.indices, array.indptr).encode('ascii'))
+            continue
+        array = np.ascontiguousarray(array)
+        digest.update(json.dumps([array.shape, array.dtype.str]).encode('ascii'))
+        flat = array.ravel()
+        step = max(1, (64 << 20) // max(1, flat.itemsize))
+        for start in range(0, flat.size, step):
+            digest.update(flat[start:start + step].tobytes())
+    return digest.hexdigest()
+
+
+def trial_key(config, budget, seed, data):
+    """Cache key of a trial
+
+    Returns:
+        str: Hex digest of the configuration, budget, seed and data hash
+    """
+    document = json.dumps({'config': normalize(config), 'budget': budget, 'seed': seed, 'data': data},
+                          sort_keys=True)
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """Results of finished trials, stored as one JSON file per trial key in a directory"""
+
+    def __init__(self, directory):
+        """Constructor
+
+        Params:
+            str: Directory of the cache, created if missing
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Returns:
+            dict: Result stored under key, None if there is none
+        """
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        """Stores a result under key, replacing the file atomically so readers never see half of it"""
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, 'w') as f:
+            json.dump(result, f, sort_keys=True)
+        os.rename(temporary, self._path(key))
+
+
+def build(config, budget, input_size, output_size, seed=None):
+    """Creates the network and trainer described by a configuration
+
+    Params:
+        dict: Configuration
+        int: Iterations (epochs for the stochastic optimizers); None uses the configuration's budget
+        int: # of inputs of the data
+        int: # of outputs of the data
+        int: Seed of the initial weights and of the shuffling
+
+    Returns:
+        ForwardNN: Untrained network
+        Trainer: Trainer of the network
+    """
+    layers = (input_size,) + tuple(config.get('hidden', ())) + (output_size,)
+    NN = ForwardNN.ForwardNN(layers, activation=config.get('activation'), loss=config.get('loss'),
+                             bias=config.get('bias', False), init=config.get('init', ForwardNN.ForwardNN.NORMAL_INIT),
+                             dtype=config.get('dtype', DEFAULT_DTYPE), seed=seed)
+    if budget is None:
+        budget = config.get('budget', DEFAULT_BUDGET)
+
+    method = config.get('optimizer', ForwardNN.Trainer.BFGS)
+    if method in OPTIMIZERS:
+        kwargs = {}
+        if 'learning_rate' in config:
+            kwargs['learning_rate'] = config['learning_rate']
+        trainer = ForwardNN.Trainer(NN, optimizer=OPTIMIZERS[method](**kwargs), epochs=budget,
+                                    batch_size=config.get('batch_size', 32), seed=seed)
+    else:
+        trainer = ForwardNN.Trainer(NN, method=method, maxiter=budget)
+    return NN, trainer
+
+
+def _init_worker(x, y, validation):
+    """Keeps the training data mapped by the TaskPool and the validation data"""
+    _worker['x'] = x
+    _worker['y'] = y
+    _worker['validation'] = validation
+
+
+def _run_trial(task):
+    """Trains one configuration and measures it
+
+    Params:
+        tuple: Trial key, configuration, budget and seed
+
+    Returns:
+        str: Trial key
+        dict: Result; config, budget, seed, cost (sum of squares on the validation or training data),
+                training_cost, iterations and seconds
+    """
+    key, config, budget, seed = task
+    x, y = _worker['x'], _worker['y']
+    start = time.time()
+    NN, trainer = build(config, budget, x.shape[1], y.shape[1], seed)
+    trainer.train(x, y)
+
+    test_x, test_y = _worker['validation'] if _worker['validation'] is not None else (x, y)
+    cost = float(activations.get_loss("sse").value(NN.cast(test_y), NN.predict(test_x)))
+    return key, {
+        'config': config,
+        'budget': budget,
+        'seed': seed,
+        'cost': cost,
+        'training_cost': trainer.cost,
+        'iterations': trainer.iterations,
+        'seconds': time.time() - start,
+    }
+
+
+def _rank(result):
+    """Sort key putting the lowest costs first and NaN costs last"""
+    return (np.isnan(result['cost']), result['cost'])
+
+
+def evaluate(configs, x, y, budget=None, validation=None, workers=None, cache=None, seed=0, callback=None):
+    """Trains configurations in parallel, skipping those found in the cache
+
+    Params:
+        list: dict; Configurations
+        ndarray: Input value for the Neural Networks
+        ndarray: Expected output value from the Neural Networks
+        int: Budget of every trial; None uses each configuration's budget
+        tuple: (input, expected output) the trials are ranked on; None ranks them on the training data
+        int: Number of worker processes; None uses every core, 1 trains in this process
+        ResultCache: Cache read before training and written after; None trains every configuration
+        int: Seed of the initial weights of every trial
+        function: Called as callback(result) for every result, cached ones included
+
+    Returns:
+        list: dict; Result of every configuration (see _run_trial), cached ones marked with cached=True,
+                sorted from the lowest cost
+    """
+    data = data_hash(x, y, *(validation or ()))
+    results = []
+    tasks = []
+    for config in configs:
+        config = normalize(config)
+        trial_budget = budget if budget is not None else config.get('budget', DEFAULT_BUDGET)
+        key = trial_key(config, trial_budget, seed, data)
+        result = cache.get(key) if cache is not None else None
+        if result is not None:
+            result['cached'] = True
+            results.append(result)
+            if callback is not None:
+                callback(result)
+        else:
+            tasks.append((key, config, trial_budget, seed))
+
+    # The workers map the data in the dtype of the networks, so the trials of each dtype share their own copy
+    groups = {}
+    for task in tasks:
+        groups.setdefault(np.dtype(task[1].get('dtype', DEFAULT_DTYPE)).name, []).append(task)
+    for dtype in sorted(groups):
+        with parallel.TaskPool(x, y, np.dtype(dtype), _init_worker, (validation,), workers) as pool:
+            for key, result in pool.imap_unordered(_run_trial, groups[dtype]):
+                if cache is not None:
+                    cache.put(key, result)
+                result['cached'] = False
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+
+    return sorted(results, key=_rank)
+
+
+def grid_search(space, x, y, **kwargs):
+    """Evaluates every configuration of a search space (see evaluate for the keyword arguments)
+
+    Returns:
+        list: dict; Results sorted from the lowest cost
+    """
+    return evaluate(grid(space), x, y, **kwargs)
+
+
+def random_search(space, x, y, trials, sample_seed=None, **kwargs):
+    """Evaluates random configurations of a search space (see evaluate for the keyword arguments)
+
+    Returns:
+        list: dict; Results sorted from the lowest cost
+    """
+    return evaluate(sample(space, trials, sample_seed), x, y, **kwargs)
+
+
+def successive_halving(configs, x, y, min_budget, max_budget, eta=3, **kwargs):
+    """Trains every configuration with a small budget, then only the best 1 / eta of them with eta times more
+
+    Each round trains its configurations from scratch with the larger budget, so every trial is cached
+    on its own and a later search with other rounds reuses it.
+
+    Params:
+        list: dict; Configurations
+        ndarray: Input value for the Neural Networks
+        ndarray: Expected output value from the Neural Networks
+        int: Budget of the first round
+        int: Budget of the last round
+        int: Factor by which every round cuts the configurations and grows the budget
+        **kwargs: Keyword arguments of evaluate besides budget
+
+    Returns:
+        list: dict; Results of the last round sorted from the lowest cost
+        list: list; Results of every round
+    """
+    rounds = []
+    budget = min_budget
+    while True:
+        results = evaluate(configs, x, y, budget=budget, **kwargs)
+        rounds.append(results)
+        if budget >= max_budget or len(results) <= 1:
+            return results, rounds
+        keep = max(1, len(results) // eta)
+        configs = [result['config'] for result in results[:keep]]
+        budget = min(max_budget, budget * eta)
+
+
+def hyperband(space, x, y, max_budget, eta=3, sample_seed=None, **kwargs):
+    """Runs successive halving brackets that trade more random configurations for smaller first budgets
+
+    Params:
+        dict: Search space
+        ndarray: Input value for the Neural Networks
+        ndarray: Expected output value from the Neural Networks
+        int: Largest budget of a trial
+        int: Factor by which every round cuts the configurations and grows the budget
+        int: Seed of the sampling
+        **kwargs: Keyword arguments of evaluate besides budget
+
+    Returns:
+        list: dict; Results of the last round of every bracket sorted from the lowest cost
+    """
+    brackets = int(math.log(max_budget) / math.log(eta) + 1e-9)
+    finals = []
+    for bracket in range(brackets, -1, -1):
+        count = int(math.ceil((brackets + 1) * eta ** bracket / float(bracket + 1)))
+        min_budget = max(1, int(max_budget / eta ** bracket))
+        seed = None if sample_seed is None else sample_seed + bracket
+        results, _ = successive_halving(sample(space, count, seed), x, y, min_budget, max_budget, eta, **kwargs)
+        finals.extend(results)
+    return sorted(finals, key=_rank)
+
+
+def _print_result(result):
+    print("cost %10.5f   budget %5d   %7.2f s%s   %s" % (result['cost'], result['budget'], result['seconds'],
+                                                       " (cached)" if result['cached'] else "",
+                                                       json.dumps(result['config'], sort_keys=True)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Searches Neural Network configurations for a data set")
+    parser.add_argument("input", metavar="I", help="Input data points")
+    parser.add_argument("output", metavar="O", help="Expected output data")
+    parser.add_argument("--strategy", default="grid", choices=["grid", "random", "halving", "hyperband"],
+                        help="Search strategy")
+    parser.add_argument("--hidden", nargs='+', default=["20"],
+                        help="Candidate hidden layers, sizes separated by commas (e.g. 20 50 20,20); "
+                             "an empty string for none")
+    parser.add_argument("--activation", nargs='+', default=["sigmoid"], choices=sorted(activations.ACTIVATIONS),
+                        help="Candidate activations of every layer")
+    parser.add_argument("--optimizer", nargs='+', default=[ForwardNN.Trainer.BFGS],
+                        choices=[ForwardNN.Trainer.BFGS, ForwardNN.Trainer.L_BFGS_B] + sorted(OPTIMIZERS),
+                        help="Candidate optimizers")
+    parser.add_argument("--dtype", nargs='+', default=[DEFAULT_DTYPE], choices=["float32", "float64"],
+                        help="Candidate dtypes of the weights and computations")
+    parser.add_argument("--budget", type=int, nargs='+', default=[DEFAULT_BUDGET],
+                        help="Candidate budgets (grid and random); the largest is the maximum of halving and hyperband")
+    parser.add_argument("--min-budget", type=int, default=10, help="First round budget (halving)")
+    parser.add_argument("--eta", type=int, default=3, help="Reduction factor (halving and hyperband)")
+    parser.add_argument("--trials", type=int, default=10, help="# of configurations (random and halving)")
+    parser.add_argument("--validation", type=float, default=0.0,
+                        help="Fraction of the data held out to rank the trials (0 ranks them on the training data)")
+    parser.add_argument("--workers", type=int, default=0, help="# of parallel processes (0 uses every core)")
+    parser.add_argument("--cache", default=".search-cache", help="Directory of the result cache ('' disables it)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the weights, sampling and validation split")
+    args = parser.parse_args()
+
+    X = dataset.read_matrix(args.input)
+    Y = dataset.read_matrix(args.output)
+    validation = None
+    if args.validation > 0:
+        order = np.random.RandomState(args.seed).permutation(X.shape[0])
+        held = max(1, int(round(args.validation * X.shape[0])))
+        validation = (X[order[:held]], Y[order[:held]])
+        X, Y = X[order[held:]], Y[order[held:]]
+
+    space = {
+        'hidden': [[int(size) for size in hidden.split(",") if size] for hidden in args.hidden],
+        'activation': args.activation,
+        'optimizer': args.optimizer,
+    }
+    if args.dtype != [DEFAULT_DTYPE]:
+        # Configurations without a dtype keep the cache keys of earlier searches
+        space['dtype'] = args.dtype
+    kwargs = {'validation': validation, 'workers': args.workers or None, 'seed': args.seed,
+              'cache': ResultCache(args.cache) if args.cache else None, 'callback': _print_result}
+
+    if args.strategy == "grid":
+        space['budget'] = args.budget
+        results = grid_search(space, X, Y, **kwargs)
+    elif args.strategy == "random":
+        space['budget'] = args.budget
+        results = random_search(space, X, Y, args.trials, sample_seed=args.seed, **kwargs)
+    elif args.strategy == "halving":
+        results, _ = successive_halving(sample(space, args.trials, args.seed), X, Y, args.min_budget,
+                                        max(args.budget), args.eta, **kwargs)
+    else:
+        results = hyperband(space, X, Y, max(args.budget), args.eta, sample_seed=args.seed, **kwargs)
+
+    print("\nBest configurations:")
+    for result in results[:5]:
+        _print_result(result)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""Local HTTP inference server for a saved ForwardNN.
+
+Concurrent requests are collected into micro-batches: a single thread waits at most a latency
+budget for more requests (or until a batch is full) and runs one forward over all of them.
+
+Endpoints:
+    POST /predict   {"inputs": [[...], ...]} or {"inputs": [...]} -> {"outputs": [[...], ...]}
+    GET  /metrics   Latency percentiles, throughput and batch sizes
+    GET  /health    {"status": "ok"}
+
+Run `python server.py -h` for the options.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import threading
+import time
+
+import numpy as np
+
+import checkpoint
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+__author__ = 'John Bucknam & Bill Clark'
+
+
+class _Request(object):
+    """Inputs of one request waiting for their outputs"""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.outputs = None
+        self.error = None
+        self.received = time.time()
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """Runs the forward of many concurrent requests as one matrix operation"""
+
+    def __init__(self, NN, max_batch=256, max_latency=0.005, window=10000):
+        """Constructor
+
+        Params:
+            ForwardNN: Network answering the requests
+            int: Maximum # of data points forwarded together
+            float: Seconds the first request of a batch may wait for others to join it
+            int: # of most recent requests the latency percentiles are computed over
+        """
+        self.neural_net = NN
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._thread = None
+
+        # Metrics
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._started = time.time()
+        self._requests = 0
+        self._rows = 0
+        self._batches = 0
+
+    def start(self):
+        """Starts the thread forwarding the batches"""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the batching thread once the queued requests are answered"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def predict(self, inputs):
+        """Queues inputs for the next batch and waits for their outputs
+
+        Params:
+            ndarray: [n, InputLayerSize] data points
+
+        Returns:
+            ndarray: [n, OutputLayerSize] outputs of the network
+        """
+        request = _Request(inputs)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def _collect(self):
+        """Waits for a request, then gathers more until the batch is full or the latency budget is spent
+
+        Returns:
+            list: _Request; None when stopped
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = first.inputs.shape[0]
+        deadline = time.time() + self.max_latency
+        while rows < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Answers this batch first, then stops
+                self._queue.put(None)
+                break
+            batch.append(request)
+            rows += request.inputs.shape[0]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                outputs = self.neural_net.predict(np.vstack([request.inputs for request in batch]))
+                start = 0
+                for request in batch:
+                    end = start + request.inputs.shape[0]
+                    request.outputs = outputs[start:end]
+                    start = end
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            finished = time.time()
+            with self._lock:
+                self._batches += 1
+                for request in batch:
+                    self._requests += 1
+                    self._rows += request.inputs.shape[0]
+                    self._latencies.append(finished - request.received)
+            for request in batch:
+                request.done.set()
+
+    def metrics(self):
+        """Returns the latency, throughput and batching statistics since start
+
+        Returns:
+            dict: Floats; p50/p99 latency in milliseconds, requests and rows per second, mean batch size
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            elapsed = max(time.time() - self._started, 1e-9)
+            result = {
+                'requests': self._requests,
+                'rows': self._rows,
+                'batches': self._batches,
+                'requests_per_second': self._requests / elapsed,
+                'rows_per_second': self._rows / elapsed,
+                'mean_batch_rows': float(self._rows) / self._batches if self._batches else 0.0,
+            }
+        for percentile in (50, 99):
+            result['p%d_ms' % percentile] = (float(np.percentile(latencies, percentile)) * 1000
+                                             if latencies.size else None)
+        return result
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Connections waiting to be accepted; socketserver's default of 5 resets clients under load
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set by serve
+    batcher = None
+    input_size = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._reply(200, self.batcher.metrics())
+        elif self.path == "/health":
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': "Unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._reply(404, {'error': "Unknown path " + self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            inputs = np.array(json.loads(self.rfile.read(length).decode('utf-8'))['inputs'], dtype=float)
+            if inputs.ndim == 1:
+                inputs = inputs.reshape(1, -1)
+            if inputs.ndim != 2 or inputs.shape[1] != self.input_size:
+                raise ValueError("Inputs must have " + str(self.input_size) + " values each")
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        try:
+            outputs = self.batcher.predict(inputs)
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, {'outputs': outputs.tolist()})
+
+    def log_message(self, format, *args):
+        # Requests are counted in /metrics instead of logged one per line
+        pass
+
+
+def serve(NN, host="127.0.0.1", port=8000, max_batch=256, max_latency=0.005, backlog=256):
+    """Serves a network over HTTP until interrupted
+
+    Params:
+        ForwardNN: Network answering the requests
+        str: Address to listen on
+        int: Port to listen on
+        int: Maximum # of data points forwarded together
+        float: Seconds the first request of a batch may wait for others to join it
+        int: # of connections the listening socket queues before it refuses more
+    """
+    batcher = MicroBatcher(NN, max_batch, max_latency)
+    batcher.start()
+
+    handler = type('Handler', (_Handler,), {'batcher': batcher, 'input_size': NN.inputLayerSize})
+    httpd = _ThreadingHTTPServer((host, port), handler, bind_and_activate=False)
+    httpd.request_queue_size = backlog
+    try:
+        httpd.server_bind()
+        httpd.server_activate()
+    except Exception:
+        httpd.server_close()
+        batcher.stop()
+        raise
+    print("Serving " + str(NN.layerSizes) + " on http://" + host + ":" + str(port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        batcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves a saved Neural Network over HTTP")
+    parser.add_argument("params", metavar="W", help="Checkpoint saved by the script's save command")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--max-batch", type=int, default=256, help="Maximum # of data points forwarded together")
+    parser.add_argument("--max-latency-ms", type=float, default=5.0,
+                        help="Milliseconds a request may wait for others to join its batch")
+    parser.add_argument("--backlog", type=int, default=256,
+                        help="# of connections queued while the server is busy before new ones are refused")
+    args = parser.parse_args()
+
+    serve(checkpoint.load(args.params), args.host, args.port, args.max_batch, args.max_latency_ms / 1000.0,
+          args.backlog)